@@ -26,50 +26,75 @@ def hilbert_curve(n):
     c = t + t.size*2
     d = np.flipud(np.rot90(t, -1)) + t.size*3
     # and stack four tiles into resulting array
-    return np.vstack(map(np.hstack, [[a, b], [d, c]]))
+    return np.vstack(list(map(np.hstack, [[a, b], [d, c]])))
+
+
+def get_curve_index(n):
+    """
+    Returns cached flat Hilbert curve permutation for (n, n) array.
+
+    Element `k` of the result is a position on the curve of the `k`-th pixel of a row-major flattened array.
+    """
+    if n not in _curves:
+        idx = hilbert_curve(n).reshape((n * n,))
+        idx.setflags(write=False)
+        _curves[n] = idx
+    return _curves[n]
 
 
 def hilbert_expand(arr):
-    if not len(arr.shape) == 2:
-        raise ValueError('Hilbert expand supports only 2D arrays, %s is given.' % repr(arr.shape))
-    if not arr.shape[0] == arr.shape[1]:
+    """
+    Expands (n, n) array or (N, n, n) stack of arrays into (n*n,) vector or (N, n*n) stack of vectors.
+    """
+    if len(arr.shape) not in (2, 3):
+        raise ValueError('Hilbert expand supports only 2D arrays or 3D stacks of them, %s is given.'
+                         % repr(arr.shape))
+    if not arr.shape[-2] == arr.shape[-1]:
         raise ValueError('Hilbert expand supports only square arrays, %s is given.' % repr(arr.shape))
-    if not is_power_of_2(arr.shape[0]):
+    if not is_power_of_2(arr.shape[-1]):
         raise ValueError('Hilbert expand array side should be a power of 2 but %s is given.' % repr(arr.shape))
 
-    n = arr.shape[0]
-    if n not in _curves:
-        _curves[n] = hilbert_curve(n)
-    idx = _curves[n]
-
-    vec = np.zeros((n * n), arr.dtype)
+    n = arr.shape[-1]
+    idx = get_curve_index(n)
 
-    for i in range(n):
-        for j in range(n):
-            vec[idx[i][j]] = arr[i][j]
+    flat = arr.reshape(arr.shape[:-2] + (n * n,))
+    vec = np.empty_like(flat)
+    vec[..., idx] = flat
 
     return vec
 
 
 def hilbert_wrap(vec):
+    """
+    Wraps vector into (n, n) array. Arrays of any shape are flattened into a single vector.
+    """
     if not len(vec.shape) == 1:
-        # Convert to 10dimensional array
+        # Convert to 1-dimensional array
         vec = vec.reshape((vec.size,))
     if not is_power_of_2(vec.size):
         raise ValueError('Hilbert wrap vector side should be a power of 2 size, %s is given.' % repr(vec.size))
 
     n = math.floor(math.sqrt(vec.size))
-    if n not in _curves:
-        _curves[n] = hilbert_curve(n)
-    idx = _curves[n]
+    idx = get_curve_index(n)
+
+    return vec[idx].reshape((n, n))
+
+
+def hilbert_wrap_stack(vecs):
+    """
+    Wraps (N, n*n) stack of vectors into (N, n, n) stack of arrays.
+    """
+    if not len(vecs.shape) == 2:
+        raise ValueError('Hilbert wrap stack supports only 2D stacks of vectors, %s is given.' % repr(vecs.shape))
 
-    arr = np.zeros((n, n), vec.dtype)
+    size = vecs.shape[1]
+    n = int(math.sqrt(size))
+    if not (n * n == size and is_power_of_2(n)):
+        raise ValueError('Hilbert wrap vector size should be a square of a power of 2, %s is given.' % repr(size))
 
-    for i in range(n):
-        for j in range(n):
-            arr[i][j] = vec[idx[i][j]]
+    idx = get_curve_index(n)
 
-    return arr
+    return vecs[:, idx].reshape((vecs.shape[0], n, n))
 
 
 def __test():
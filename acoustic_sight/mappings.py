@@ -0,0 +1,284 @@
+"""
+Spatial-to-tone mappings.
+
+Each mapping orders pixels of a (height, width) frame into a vector of tones. Mappings are precomputed once into a
+flat permutation index (element `k` is a tone of the `k`-th pixel of a row-major flattened frame) and persisted as
+memory-mapped `.npy` files keyed by mapping name and frame shape.
+"""
+import os
+
+import numpy as np
+
+from acoustic_sight import hilbert_curve
+from acoustic_sight.tools import CACHE_DIR, get_logger, load_array, save_array
+
+
+logger = get_logger('mappings')
+
+
+ROW_MAJOR = 'row_major'
+Z_ORDER = 'z_order'
+HILBERT = 'hilbert'
+PEANO = 'peano'
+
+CACHE_VERSION = 1
+
+_builders = dict()
+_indexes = dict()
+_mappings = dict()
+
+
+def register_mapping(name, builder, cache=True):
+    """
+    Registers mapping builder under the given name.
+
+    Builder accepts `(height, width)` and returns `(height, width)` integer array of positions of each pixel along
+    the curve. If `cache` is set the built index is persisted to the disk.
+    """
+    _builders[name] = (builder, cache)
+
+
+def get_mapping_names():
+    return tuple(_builders.keys())
+
+
+def _get_cache_path(name, shape, cache_dir):
+    return os.path.join(cache_dir, 'mapping-v{version}-{name}-{height}x{width}.npy'.format(
+        version=CACHE_VERSION, name=name, height=shape[0], width=shape[1],
+    ))
+
+
+def _build_index(name, shape):
+    builder, _ = _builders[name]
+    idx = np.asarray(builder(*shape), dtype=np.int32)
+
+    if idx.shape != shape:
+        raise ValueError('Mapping "{name}" returned {returned} index for {shape} frame.'.format(
+            name=name, returned=repr(idx.shape), shape=repr(shape)))
+
+    return idx.reshape((idx.size,))
+
+
+def get_mapping_index(name, shape, cache_dir=CACHE_DIR):
+    """
+    Returns read-only flat permutation index of a mapping for (height, width) frame.
+
+    Index is built only once per process, and only once per cache directory if mapping supports caching.
+    """
+    if name not in _builders:
+        raise ValueError('Mapping is not supported: {name}. Available mappings: {names}.'.format(
+            name=name, names=', '.join(get_mapping_names())))
+
+    shape = (int(shape[0]), int(shape[1]))
+    key = (name, shape)
+
+    if key not in _indexes:
+        _, cache = _builders[name]
+        path = _get_cache_path(name, shape, cache_dir) if cache and cache_dir is not None else None
+
+        idx = None
+        if path is not None:
+            idx = load_array(path)
+            if idx is not None:
+                logger.debug('Loaded cached {name} mapping for {shape} frame from {path}.'.format(
+                    name=name, shape=shape, path=path))
+
+        if idx is None or idx.shape != (shape[0] * shape[1],):
+            idx = _build_index(name, shape)
+            logger.debug('Built {name} mapping for {shape} frame.'.format(name=name, shape=shape))
+
+            if path is not None:
+                try:
+                    idx = save_array(idx, path)
+                except OSError as e:
+                    logger.warning('Failed to cache mapping to {path}: {e}'.format(path=path, e=e))
+
+            idx.setflags(write=False)
+
+        _indexes[key] = idx
+
+    return _indexes[key]
+
+
+class SpatialMapping(object):
+    """Reorders (height, width) frames into tone vectors and back."""
+    def __init__(self, name, shape, cache_dir=CACHE_DIR):
+        self.name = name
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.size = self.shape[0] * self.shape[1]
+        self.index = get_mapping_index(name, self.shape, cache_dir=cache_dir)
+
+    def expand(self, arr):
+        """Expands (height, width) frame or (N, height, width) stack of frames into tone vectors."""
+        if arr.shape[-2:] != self.shape or len(arr.shape) not in (2, 3):
+            raise ValueError('{name} mapping expects {shape} frames or their stacks, {given} is given.'.format(
+                name=self.name, shape=repr(self.shape), given=repr(arr.shape)))
+
+        flat = arr.reshape(arr.shape[:-2] + (self.size,))
+        vec = np.empty_like(flat)
+        vec[..., self.index] = flat
+
+        return vec
+
+    def wrap(self, vec):
+        """Wraps (height*width,) tone vector or (N, height*width) stack of vectors into frames."""
+        if vec.shape[-1] != self.size or len(vec.shape) not in (1, 2):
+            raise ValueError('{name} mapping expects {size} sized vectors or their stacks, {given} is given.'.format(
+                name=self.name, size=self.size, given=repr(vec.shape)))
+
+        return vec[..., self.index].reshape(vec.shape[:-1] + self.shape)
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return '{cls}({name!r}, {shape!r})'.format(cls=self.__class__.__name__, name=self.name, shape=self.shape)
+
+
+def get_mapping(name, shape, cache_dir=CACHE_DIR):
+    """Returns shared SpatialMapping instance for the given mapping name and (height, width) frame shape."""
+    key = (name, (int(shape[0]), int(shape[1])), cache_dir)
+    if key not in _mappings:
+        _mappings[key] = SpatialMapping(name, shape, cache_dir=cache_dir)
+    return _mappings[key]
+
+
+def _rank(keys):
+    """Converts sort keys into positions along the curve."""
+    order = np.argsort(keys, kind='mergesort')
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(order.size, dtype=order.dtype)
+    return ranks
+
+
+def row_major_curve(height, width):
+    return np.arange(height * width, dtype=np.int32).reshape((height, width))
+
+
+def z_order_curve(height, width):
+    """Morton (Z-order) indexing of (height, width) array. Cells outside of the frame are skipped."""
+    ys, xs = np.indices((height, width), dtype=np.uint64)
+    codes = np.zeros((height, width), dtype=np.uint64)
+
+    bits = max(int(height - 1).bit_length(), int(width - 1).bit_length())
+    for b in range(bits):
+        bit = np.uint64(b)
+        codes |= ((xs >> bit) & np.uint64(1)) << np.uint64(2 * b)
+        codes |= ((ys >> bit) & np.uint64(1)) << np.uint64(2 * b + 1)
+
+    return _rank(codes.reshape((codes.size,))).reshape((height, width))
+
+
+def _sgn(x):
+    return (x > 0) - (x < 0)
+
+
+def _gilbert(x, y, ax, ay, bx, by):
+    """
+    Generalized Hilbert ('gilbert') space-filling curve for arbitrary sized rectangles.
+    Taken from https://github.com/jakubcerveny/gilbert. Thanks to Jakub Červený.
+    """
+    w = abs(ax + ay)
+    h = abs(bx + by)
+
+    (dax, day) = (_sgn(ax), _sgn(ay))
+    (dbx, dby) = (_sgn(bx), _sgn(by))
+
+    if h == 1:
+        for _ in range(w):
+            yield x, y
+            (x, y) = (x + dax, y + day)
+        return
+
+    if w == 1:
+        for _ in range(h):
+            yield x, y
+            (x, y) = (x + dbx, y + dby)
+        return
+
+    (ax2, ay2) = (ax // 2, ay // 2)
+    (bx2, by2) = (bx // 2, by // 2)
+
+    w2 = abs(ax2 + ay2)
+    h2 = abs(bx2 + by2)
+
+    if 2 * w > 3 * h:
+        if (w2 % 2) and (w > 2):
+            (ax2, ay2) = (ax2 + dax, ay2 + day)
+
+        yield from _gilbert(x, y, ax2, ay2, bx, by)
+        yield from _gilbert(x + ax2, y + ay2, ax - ax2, ay - ay2, bx, by)
+    else:
+        if (h2 % 2) and (h > 2):
+            (bx2, by2) = (bx2 + dbx, by2 + dby)
+
+        yield from _gilbert(x, y, bx2, by2, ax2, ay2)
+        yield from _gilbert(x + bx2, y + by2, ax, ay, bx - bx2, by - by2)
+        yield from _gilbert(x + (ax - dax) + (bx2 - dbx), y + (ay - day) + (by2 - dby),
+                            -bx2, -by2, -(ax - ax2), -(ay - ay2))
+
+
+def generalized_hilbert_curve(height, width):
+    """Generalized Hilbert curve indexing for (height, width) array of any size."""
+    if width >= height:
+        points = _gilbert(0, 0, width, 0, 0, height)
+    else:
+        points = _gilbert(0, 0, 0, height, width, 0)
+
+    coords = np.array(list(points), dtype=np.int64).reshape((height * width, 2))
+    idx = np.empty((height, width), dtype=np.int32)
+    idx[coords[:, 1], coords[:, 0]] = np.arange(height * width, dtype=np.int32)
+
+    return idx
+
+
+def hilbert_mapping_curve(height, width):
+    """Classic Hilbert curve for power of 2 squares and generalized Hilbert curve for the other frames."""
+    if height == width and hilbert_curve.is_power_of_2(width):
+        return hilbert_curve.hilbert_curve(width)
+    return generalized_hilbert_curve(height, width)
+
+
+def peano_curve(n):
+    """Generate Peano curve indexing for (n, n) array. 'n' must be a power of three."""
+    idx = np.zeros((1, 1), np.int32)
+    side = 1
+    while side < n:
+        size = idx.size
+        flipped_rows = np.flipud(idx)
+        flipped_cols = np.fliplr(idx)
+        flipped_both = np.flipud(flipped_cols)
+        # Tiles are traversed column by column in a serpentine order
+        tiles = [[None] * 3 for _ in range(3)]
+        for col in range(3):
+            for step in range(3):
+                row = step if col % 2 == 0 else 2 - step
+                if col % 2 == 0:
+                    tile = idx if row % 2 == 0 else flipped_cols
+                else:
+                    tile = flipped_rows if row % 2 == 0 else flipped_both
+                tiles[row][col] = tile + (col * 3 + step) * size
+        idx = np.vstack([np.hstack(row) for row in tiles])
+        side *= 3
+
+    if side != n:
+        raise ValueError('Peano curve side should be a power of 3 but {} is given.'.format(n))
+
+    return idx
+
+
+def peano_mapping_curve(height, width):
+    """Peano curve of the smallest enclosing power of 3 square. Cells outside of the frame are skipped."""
+    side = 1
+    while side < max(height, width):
+        side *= 3
+
+    positions = peano_curve(side)[:height, :width]
+
+    return _rank(positions.reshape((positions.size,))).reshape((height, width))
+
+
+register_mapping(ROW_MAJOR, row_major_curve, cache=False)
+register_mapping(Z_ORDER, z_order_curve)
+register_mapping(HILBERT, hilbert_mapping_curve)
+register_mapping(PEANO, peano_mapping_curve)
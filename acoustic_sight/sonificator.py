@@ -1,44 +1,172 @@
 import logging
-import math
+import time
+
+import numpy as np
 
 from acoustic_sight import sound_drivers
-from acoustic_sight import hilbert_curve
+from acoustic_sight import mappings, volume_curves
 from acoustic_sight.tools import TimeMeasurer, get_logger
 
 
+# Fading tones are cut off below this volume
+FADE_THRESHOLD = 1e-3
+
+
 class Sonificator:
     def __init__(self, side_in, octaves=3, shift=-18, synth_type=sound_drivers.SUPER_COLLIDER,
-                 volume_type='linear', max_volume=.5, logger=None, log_level=logging.INFO,
-                 profile=False,
+                 volume_type=volume_curves.LINEAR, max_volume=.5, logger=None, log_level=logging.INFO,
+                 profile=False, mapping=mappings.HILBERT, shape=None,
+                 update_epsilon=0., hysteresis=0., quantization=None,
+                 separate_process=False, top_k=None, top_k_fade=.5, latency=None,
                  ):
+        """
+        Tones are updated only if their volume changed by more than `update_epsilon`. Changes reverting the previous
+        change of a tone should additionally exceed `hysteresis`. If `quantization` is set volumes are rounded to this
+        number of levels before comparison.
+
+        If `separate_process` is set sound driver runs in a dedicated process isolated from image processing stalls.
+
+        If `top_k` is set only the `top_k` loudest tones are sonified in each frame. Tones dropped from this set fade out
+        by `top_k_fade` per frame and are stopped when silent, so drivers may skip inactive voices.
+
+        If `latency` (seconds) is set each frame is scheduled to be heard this long after it was captured, so frames
+        are played with constant delay on drivers which support scheduling.
+        """
+        if logger is None:
+            self.logger = get_logger('Sonificator', level=log_level)
+        else:
+            self.logger = logger
+
+        if shape is None:
+            shape = (side_in, side_in)
+        self.mapping = mappings.get_mapping(mapping, shape)
+
         self.volume_type = volume_type
         self.max_volume = max_volume
+        self.volume_table = volume_curves.get_volume_table(volume_type, max_volume, quantization)
 
-        if profile:
-            if logger is None:
-                self.logger = get_logger('Sonificator', level=log_level)
-            else:
-                self.logger = logger
+        self.update_epsilon = update_epsilon
+        self.hysteresis = hysteresis
+        # Last volumes sent to the synth and directions of the last change for each tone
+        self.sent_volumes = None
+        self.last_directions = np.zeros(len(self.mapping), dtype=np.int8)
+
+        self.top_k = int(top_k) if top_k else None
+        self.top_k_fade = top_k_fade
+        self.latency = float(latency) if latency else None
+        self.active = np.ones(len(self.mapping), dtype=bool)
+
+        self.updated_tones = 0
+        self.skipped_tones = 0
+        self.total_updated_tones = 0
+        self.total_skipped_tones = 0
 
+        if profile:
             self.time_measurer = TimeMeasurer(self.logger)
             self.time_measurer.decorate_method(self, self.sonify, 'Sonified')
 
-        Synth, init_audio = sound_drivers.get_driver(synth_type)
+        if separate_process:
+            from acoustic_sight.sound_drivers.process_tools import SynthProcess
+            self.synth = SynthProcess(synth_type, levels=len(self.mapping), octaves=octaves, shift=shift)
+        else:
+            Synth, init_audio = sound_drivers.get_driver(synth_type)
 
-        init_audio()
-        self.synth = Synth(levels=side_in*side_in, octaves=octaves, shift=shift)
+            init_audio()
+            self.synth = Synth(levels=len(self.mapping), octaves=octaves, shift=shift)
         self.synth.play()
 
-    def sonify(self, arr):
-        vec = hilbert_curve.hilbert_expand(arr)
-        for i in range(len(vec)):
-            if self.volume_type == 'linear':
-                self.synth[i] = vec[i] / 255 * self.max_volume
-            elif self.volume_type == 'threshold':
-                self.synth[i] = (vec[i] > 127) * 1.
-            elif self.volume_type == 'exp':
-                self.synth[i] = (math.exp(vec[i] / 255) - 1) / (math.exp(1) - 1) * self.max_volume
-        self.synth.sync()
+    def select_top_k(self, volumes):
+        """Keeps the loudest `top_k` volumes and fades out the rest from previously sent ones (in-place)."""
+        outside = np.ones(len(volumes), dtype=bool)
+        if self.top_k < len(volumes):
+            outside[np.argpartition(volumes, -self.top_k)[-self.top_k:]] = False
+        else:
+            outside[:] = False
+
+        if self.sent_volumes is None:
+            faded = 0
+        else:
+            sent = self.sent_volumes[outside]
+            faded = sent * self.top_k_fade
+            # Fade steps too small to pass update thresholds would never be sent, so such tones are cut off
+            faded[(faded < FADE_THRESHOLD) | (sent - faded <= self.update_epsilon + self.hysteresis)] = 0
+        volumes[outside] = np.minimum(volumes[outside], faded)
+
+        return volumes
+
+    def update_voices(self):
+        """Stops silent tones and restarts ones that became audible."""
+        audible = self.sent_volumes != 0
+        for key in np.flatnonzero(self.active & ~audible):
+            self.synth.stop(int(key))
+        for key in np.flatnonzero(~self.active & audible):
+            self.synth.play(int(key))
+        self.active = audible
+
+    def get_changed_tones(self, volumes):
+        """Returns indexes of tones which volumes should be sent to the synth."""
+        delta = volumes - self.sent_volumes
+        directions = np.sign(delta).astype(np.int8)
+
+        thresholds = np.full(delta.shape, self.update_epsilon, dtype=np.float32)
+        if self.hysteresis:
+            thresholds[directions * self.last_directions < 0] += self.hysteresis
+
+        changed = np.abs(delta) > thresholds
+        # Always let tones fall silent
+        changed |= (volumes == 0) & (self.sent_volumes != 0)
+
+        keys = np.flatnonzero(changed)
+        self.last_directions[keys] = directions[keys]
+
+        return keys
+
+    def update_counters(self, updated):
+        self.updated_tones = updated
+        self.skipped_tones = len(self.mapping) - updated
+        self.total_updated_tones += self.updated_tones
+        self.total_skipped_tones += self.skipped_tones
+
+        self.logger.debug('Tones updated: {updated}, skipped: {skipped}'.format(
+            updated=self.updated_tones, skipped=self.skipped_tones))
+
+    def get_play_time(self, timestamp=None):
+        """Returns time the frame captured at `timestamp` (now by default) should be heard at, if latency is set."""
+        if self.latency is None:
+            return None
+        if timestamp is None:
+            timestamp = time.time()
+        return timestamp + self.latency
+
+    def sonify(self, arr, timestamp=None):
+        play_time = self.get_play_time(timestamp)
+        vec = self.mapping.expand(arr)
+        volumes = self.volume_table[vec.astype(np.uint8, copy=False)]
+        if self.top_k is not None:
+            volumes = self.select_top_k(volumes)
+
+        if self.sent_volumes is None:
+            self.synth.set_volumes(volumes, timestamp=play_time)
+            self.sent_volumes = volumes
+            self.update_counters(len(volumes))
+        else:
+            keys = self.get_changed_tones(volumes)
+            if len(keys):
+                self.synth.set_volumes(volumes[keys], keys, timestamp=play_time)
+                self.sent_volumes[keys] = volumes[keys]
+            self.update_counters(len(keys))
+
+        if self.top_k is not None and self.updated_tones:
+            self.update_voices()
+
+        if self.updated_tones:
+            self.synth.sync()
 
     def silence(self):
         self.synth.silence()
+        self.sent_volumes = np.zeros(len(self.mapping), dtype=np.float32)
+        self.last_directions[:] = 0
+        if self.top_k is not None:
+            # Silent voices are stopped, sonify() restarts them once they become audible again
+            self.update_voices()
+            self.synth.sync()
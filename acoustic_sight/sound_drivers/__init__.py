@@ -1,15 +1,39 @@
 PY_AUDIO = 'PyAudio'
+PY_AUDIO_BLOCK = 'PyAudioBlock'
+PY_AUDIO_SHARDED = 'PyAudioSharded'
 PY_GAME = 'PyGame'
+PY_GAME_MIX = 'PyGameMix'
 SUPER_COLLIDER = 'SuperCollider'
+SUPER_COLLIDER_BANK = 'SuperColliderBank'
+OFFLINE = 'Offline'
+NULL = 'Null'
 
 
 def get_driver(name):
     if name == PY_AUDIO:
         import acoustic_sight.sound_drivers.pa_tools as pa_tools
         return pa_tools.PASynth, pa_tools.init_audio
+    elif name == PY_AUDIO_BLOCK:
+        import acoustic_sight.sound_drivers.pa_tools as pa_tools
+        return pa_tools.PABlockSynth, pa_tools.init_audio
+    elif name == PY_AUDIO_SHARDED:
+        import acoustic_sight.sound_drivers.sharded_tools as sharded_tools
+        return sharded_tools.PAShardedSynth, sharded_tools.init_audio
     elif name == PY_GAME:
         import acoustic_sight.sound_drivers.pg_tools as pg_tools
         return pg_tools.PGSynth, pg_tools.init_audio
+    elif name == PY_GAME_MIX:
+        import acoustic_sight.sound_drivers.pg_tools as pg_tools
+        return pg_tools.PGMixSynth, pg_tools.init_audio
     elif name == SUPER_COLLIDER:
         import acoustic_sight.sound_drivers.sc_tools as sc_tools
         return sc_tools.SCSynth, sc_tools.init_audio
+    elif name == SUPER_COLLIDER_BANK:
+        import acoustic_sight.sound_drivers.sc_tools as sc_tools
+        return sc_tools.SCBankSynth, sc_tools.init_audio
+    elif name == OFFLINE:
+        import acoustic_sight.sound_drivers.offline_tools as offline_tools
+        return offline_tools.OfflineSynth, offline_tools.init_audio
+    elif name == NULL:
+        import acoustic_sight.sound_drivers.null_tools as null_tools
+        return null_tools.NullSynth, null_tools.init_audio
@@ -0,0 +1,419 @@
+"""
+Headless sound driver microbenchmarks.
+
+Every driver is measured for a few tone counts with local stand-ins instead of audio devices: PyAudio streams are
+replaced with a fake stream which calls the callback on a timer, SuperCollider is replaced with a UDP stub which
+answers the OSC commands scsynth would answer, and PyGame uses the SDL dummy audio driver. SuperCollider drivers attach
+to the stub as to already running scsynth.
+"""
+import gc
+import json
+import os
+import platform
+import socket
+import struct
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+from acoustic_sight import sound_drivers
+from acoustic_sight.tools import get_logger
+
+
+logger = get_logger('benchmark')
+
+
+DRIVERS = (
+    sound_drivers.PY_AUDIO,
+    sound_drivers.PY_AUDIO_BLOCK,
+    sound_drivers.PY_AUDIO_SHARDED,
+    sound_drivers.PY_GAME,
+    sound_drivers.PY_GAME_MIX,
+    sound_drivers.SUPER_COLLIDER,
+    sound_drivers.SUPER_COLLIDER_BANK,
+    sound_drivers.OFFLINE,
+)
+PY_AUDIO_DRIVERS = (sound_drivers.PY_AUDIO, sound_drivers.PY_AUDIO_BLOCK, sound_drivers.PY_AUDIO_SHARDED)
+PY_GAME_DRIVERS = (sound_drivers.PY_GAME, sound_drivers.PY_GAME_MIX)
+SUPER_COLLIDER_DRIVERS = (sound_drivers.SUPER_COLLIDER, sound_drivers.SUPER_COLLIDER_BANK)
+
+TONE_COUNTS = (64, 256, 1024)
+
+SAMPLE_RATE = 96000
+FRAMES_PER_BUFFER = 1024
+# Fake stream reports DAC time this much ahead of the callback (seconds)
+OUTPUT_LATENCY = .02
+
+SC_PORT = 57110
+
+
+def get_sc_address():
+    """Returns address of the default supriya server, so the stub receives what drivers send to scsynth."""
+    try:
+        import supriya
+    except ImportError:
+        return '127.0.0.1', SC_PORT
+
+    server = supriya.servertools.Server.get_default_server()
+    return server.ip_address, server.port
+
+
+def get_stats(durations, total_time=None):
+    """Returns summary of durations (seconds) in milliseconds."""
+    if not len(durations):
+        return None
+
+    durations = np.asarray(durations, dtype=np.float64) * 1000
+    stats = {
+        'count': len(durations),
+        'mean': float(durations.mean()),
+        'p50': float(np.percentile(durations, 50)),
+        'p95': float(np.percentile(durations, 95)),
+        'max': float(durations.max()),
+    }
+    if total_time:
+        # Fraction of time spent in the measured code
+        stats['load'] = float(durations.sum() / 1000 / total_time)
+
+    return stats
+
+
+class FakeStream:
+    """PyAudio output stream stand-in which calls the callback from a timer thread in real time."""
+    def __init__(self, stream_callback, rate, channels=1, frames_per_buffer=FRAMES_PER_BUFFER, **kwargs):
+        self.callback = stream_callback
+        self.rate = rate
+        self.channels = channels
+        self.frames_per_buffer = frames_per_buffer
+
+        self.durations = []
+        self.bytes = 0
+        self._thread = None
+        self._active = False
+
+    def _run(self):
+        period = self.frames_per_buffer / self.rate
+        stream_start = time.perf_counter()
+        deadline = stream_start
+
+        while self._active:
+            current_time = time.perf_counter() - stream_start
+            time_info = {
+                'input_buffer_adc_time': 0.,
+                'current_time': current_time,
+                'output_buffer_dac_time': current_time + OUTPUT_LATENCY,
+            }
+
+            started = time.perf_counter()
+            data, _ = self.callback(None, self.frames_per_buffer, time_info, 0)
+            self.durations.append(time.perf_counter() - started)
+            self.bytes += np.asarray(data).nbytes
+
+            deadline += period
+            time.sleep(max(0., deadline - time.perf_counter()))
+
+    def start_stream(self):
+        if not self._active:
+            self._active = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop_stream(self):
+        if self._active:
+            self._active = False
+            self._thread.join()
+
+    def is_active(self):
+        return self._active
+
+    def close(self):
+        self.stop_stream()
+
+
+class FakePyAudio:
+    """PyAudio stand-in which opens fake streams."""
+    def __init__(self):
+        self.streams = []
+
+    def open(self, **kwargs):
+        stream = FakeStream(**kwargs)
+        self.streams.append(stream)
+        return stream
+
+    def terminate(self):
+        for stream in self.streams:
+            stream.close()
+
+
+def init_fake_pyaudio(bitrate=SAMPLE_RATE, channels=1):
+    """Sets fake PyAudio instance as the audio state of PyAudio drivers."""
+    try:
+        import pyaudio
+    except ImportError:
+        # Drivers only need format constants without real PyAudio
+        pyaudio = types.ModuleType('pyaudio')
+        pyaudio.paFloat32 = 1
+        pyaudio.paContinue = 0
+        pyaudio.PyAudio = FakePyAudio
+        sys.modules['pyaudio'] = pyaudio
+
+    from acoustic_sight.sound_drivers import pa_tools
+    pa_tools._pa_state = pa_tools.PAState(FakePyAudio(), bitrate, channels)
+
+    return pa_tools._pa_state.pa_instance
+
+
+def _pad(data):
+    return data + b'\x00' * (4 - len(data) % 4)
+
+
+def encode_osc_message(address, *args):
+    """Encodes OSC message with integer, float and string arguments."""
+    tags = ','
+    payload = b''
+    for arg in args:
+        if isinstance(arg, int):
+            tags += 'i'
+            payload += struct.pack('>i', arg)
+        elif isinstance(arg, float):
+            tags += 'f'
+            payload += struct.pack('>f', arg)
+        else:
+            tags += 's'
+            payload += _pad(str(arg).encode())
+
+    return _pad(address.encode()) + _pad(tags.encode()) + payload
+
+
+def _read_string(data, offset):
+    end = data.index(b'\x00', offset)
+    return data[offset:end].decode(errors='replace'), (end // 4 + 1) * 4
+
+
+def decode_osc_packet(data):
+    """Returns list of (address, first integer argument or None) of all messages in OSC packet."""
+    if data.startswith(b'#bundle\x00'):
+        messages = []
+        offset = 16
+        while offset + 4 <= len(data):
+            size, = struct.unpack('>i', data[offset:offset + 4])
+            messages.extend(decode_osc_packet(data[offset + 4:offset + 4 + size]))
+            offset += 4 + size
+        return messages
+
+    address, offset = _read_string(data, 0)
+    argument = None
+    if offset < len(data):
+        tags, offset = _read_string(data, offset)
+        if tags[1:2] == 'i':
+            argument, = struct.unpack('>i', data[offset:offset + 4])
+
+    return [(address, argument)]
+
+
+class OSCStub:
+    """
+    Local UDP stand-in for scsynth.
+
+    Counts received packets, messages and bytes, and answers status, sync and asynchronous commands, so clients
+    don't wait for the real server.
+    """
+    def __init__(self, ip_address='127.0.0.1', port=SC_PORT):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((ip_address, port))
+        self.socket.settimeout(.1)
+
+        self.packets = 0
+        self.messages = 0
+        self.bytes = 0
+
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def reset(self):
+        self.packets = 0
+        self.messages = 0
+        self.bytes = 0
+
+    def get_reply(self, address, argument):
+        if address == '/status':
+            return encode_osc_message('/status.reply', 1, 0, 0, 1, 0, 0., 0., SAMPLE_RATE * 1., SAMPLE_RATE * 1.)
+        if address == '/sync':
+            return encode_osc_message('/synced', argument or 0)
+        if address in ('/notify', '/d_recv', '/d_load', '/b_alloc', '/b_free', '/quit'):
+            return encode_osc_message('/done', address)
+        return None
+
+    def _serve(self):
+        while self._running:
+            try:
+                data, client = self.socket.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            self.packets += 1
+            self.bytes += len(data)
+            try:
+                messages = decode_osc_packet(data)
+            except (ValueError, struct.error):
+                continue
+            self.messages += len(messages)
+
+            for address, argument in messages:
+                reply = self.get_reply(address, argument)
+                if reply is not None:
+                    self.socket.sendto(reply, client)
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        self.socket.close()
+
+
+def init_driver(synth_type, osc_stub=None):
+    """Initializes audio of the driver with local stand-ins and returns its synth class."""
+    if synth_type in PY_AUDIO_DRIVERS:
+        init_fake_pyaudio()
+        Synth, _ = sound_drivers.get_driver(synth_type)
+        return Synth
+
+    Synth, init_audio = sound_drivers.get_driver(synth_type)
+
+    if synth_type in SUPER_COLLIDER_DRIVERS:
+        if osc_stub is None:
+            raise RuntimeError('SuperCollider stub is not running.')
+        # Stub answers status requests, so the driver attaches to it instead of booting scsynth
+        init_audio(attach=True)
+    else:
+        init_audio()
+
+    return Synth
+
+
+def measure_driver(synth_type, levels, frames=48, frame_rate=24, osc_stub=None, seed=0):
+    """Plays random frames through the driver and returns its measurements."""
+    Synth = init_driver(synth_type, osc_stub)
+    synth = Synth(levels=levels)
+
+    # Measure mixing of drivers which render audio without PyAudio callback
+    render_durations = []
+    if synth_type == sound_drivers.PY_GAME_MIX:
+        mix = synth.tones.mix
+
+        def timed_mix():
+            started = time.perf_counter()
+            samples = mix()
+            render_durations.append(time.perf_counter() - started)
+            return samples
+
+        synth.tones.mix = timed_mix
+
+    synth.play()
+    if osc_stub is not None:
+        osc_stub.reset()
+
+    rng = np.random.RandomState(seed)
+    frame_period = 1. / frame_rate
+    frame_samples = int(SAMPLE_RATE * frame_period)
+    latencies = []
+
+    started = time.perf_counter()
+    for frame in range(frames):
+        volumes = rng.rand(levels).astype(np.float32)
+
+        frame_started = time.perf_counter()
+        synth.set_volumes(volumes)
+        synth.sync()
+        latencies.append(time.perf_counter() - frame_started)
+
+        if synth_type == sound_drivers.OFFLINE:
+            render_started = time.perf_counter()
+            synth.render(frame_samples)
+            render_durations.append(time.perf_counter() - render_started)
+        else:
+            time.sleep(max(0., started + (frame + 1) * frame_period - time.perf_counter()))
+    total_time = time.perf_counter() - started
+
+    synth.stop()
+
+    callback_durations = render_durations
+    audio_bytes = None
+    if synth_type in PY_AUDIO_DRIVERS:
+        from acoustic_sight.sound_drivers import pa_tools
+        streams = pa_tools._pa_state.pa_instance.streams
+        callback_durations = [d for stream in streams for d in stream.durations]
+        audio_bytes = sum(stream.bytes for stream in streams)
+
+    result = {
+        'driver': synth_type,
+        'tones': levels,
+        'frames': frames,
+        'throughput': levels * frames / sum(latencies),
+        'control_latency': get_stats(latencies),
+        'callback': get_stats(callback_durations, total_time),
+        'audio_bytes': audio_bytes,
+        'messages': osc_stub.messages if osc_stub is not None else None,
+        'packets': osc_stub.packets if osc_stub is not None else None,
+        'bytes': osc_stub.bytes if osc_stub is not None else None,
+    }
+
+    del synth
+    gc.collect()
+
+    return result
+
+
+def run_benchmark(drivers=DRIVERS, tone_counts=TONE_COUNTS, frames=48, frame_rate=24, output=None):
+    """Measures all drivers for all tone counts and writes results as JSON to `output` (if given)."""
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+    osc_stub = None
+    if any(driver in SUPER_COLLIDER_DRIVERS for driver in drivers):
+        try:
+            osc_stub = OSCStub(*get_sc_address())
+        except OSError as e:
+            logger.warning('Unable to start SuperCollider stub: {}'.format(e))
+
+    results = []
+    try:
+        for driver in drivers:
+            for levels in tone_counts:
+                logger.info('Measuring {driver} driver with {levels} tones...'.format(driver=driver, levels=levels))
+                try:
+                    result = measure_driver(driver, levels, frames=frames, frame_rate=frame_rate,
+                                            osc_stub=osc_stub if driver in SUPER_COLLIDER_DRIVERS else None)
+                except Exception as e:
+                    logger.warning('Unable to measure {driver} driver: {error}'.format(driver=driver, error=e))
+                    result = {'driver': driver, 'tones': levels, 'error': repr(e)}
+                else:
+                    logger.info('{driver} with {levels} tones: {throughput:.0f} tones/s, '
+                                'control latency p95 {latency:.3f} ms'.format(
+                                    driver=driver, levels=levels, throughput=result['throughput'],
+                                    latency=result['control_latency']['p95']))
+                results.append(result)
+    finally:
+        if osc_stub is not None:
+            osc_stub.close()
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'frames': frames,
+        'frame_rate': frame_rate,
+        'results': results,
+    }
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info('Benchmark results are written to {}'.format(output))
+
+    return report
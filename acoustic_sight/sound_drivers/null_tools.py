@@ -0,0 +1,70 @@
+import numpy as np
+
+from acoustic_sight.synth import Synth, get_frequencies
+from acoustic_sight.tools import get_logger
+
+
+logger = get_logger('null_tools')
+
+
+def init_audio(*args, **kwargs):
+    logger.info('Null audio initialized.')
+
+
+def stop_audio(*args, **kwargs):
+    pass
+
+
+class NullSynth(Synth):
+    """
+    Synth which plays nothing and only records amplitudes.
+
+    Each `set_volumes` call is counted and, if `record` is set, a copy of all amplitudes is appended to `history`.
+    Useful to benchmark and test the pipeline without audio devices.
+    """
+    def __init__(self, base=440, octaves=3, levels=16, shift=-12, record=True):
+        self.levels = levels
+        self.frequencies = get_frequencies(base, octaves, self.levels, shift)
+
+        self.amplitudes = np.zeros(levels, dtype=np.float32)
+        self.on = np.zeros(levels, dtype=np.bool_)
+        self.record = record
+        self.history = []
+        self.updates = 0
+        self.updated_tones = 0
+
+    def play(self, key=None):
+        if key is None:
+            self.on[:] = True
+        else:
+            self.on[key] = True
+
+    def stop(self, key=None):
+        if key is None:
+            self.on[:] = False
+        else:
+            self.on[key] = False
+
+    def silence(self):
+        self.amplitudes[:] = 0
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        if keys is None:
+            self.amplitudes[:] = volumes
+            self.updated_tones += self.levels
+        else:
+            self.amplitudes[np.asarray(keys)] = volumes
+            self.updated_tones += len(keys)
+        self.updates += 1
+
+        if self.record:
+            self.history.append(self.amplitudes.copy())
+
+    def __getitem__(self, item):
+        return float(self.amplitudes[item])
+
+    def __setitem__(self, key, value):
+        self.set_volumes([value], [key])
+
+    def __len__(self):
+        return self.levels
@@ -0,0 +1,203 @@
+import numpy as np
+
+from acoustic_sight.synth import Synth, get_frequencies
+from acoustic_sight.tools import get_logger
+
+
+logger = get_logger('offline_tools')
+
+
+class OfflineState:
+    def __init__(self, sample_rate: int, channels: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    def __repr__(self):
+        return '{cls}(sample_rate={sample_rate}, channels={channels})'.format(
+            cls=self.__class__.__name__, sample_rate=self.sample_rate, channels=self.channels)
+
+
+_offline_state: OfflineState = None
+
+
+DEFAULT_SAMPLE_RATE = 44100
+
+
+def init_audio(sample_rate=None, channels=1):
+    """Initializes offline audio. Already configured sample rate is kept if `sample_rate` is not specified."""
+    global _offline_state
+    if sample_rate is None:
+        sample_rate = DEFAULT_SAMPLE_RATE if _offline_state is None else _offline_state.sample_rate
+    _offline_state = OfflineState(sample_rate, channels)
+    logger.info('Offline audio initialized: {}'.format(_offline_state))
+
+
+def stop_audio(*args, **kwargs):
+    pass
+
+
+class OfflineTone:
+    """Tone view to a single oscillator of OfflineToneBank."""
+    def __init__(self, bank, key):
+        self.bank = bank
+        self.key = key
+        self.frequency = bank.frequencies[key]
+
+    def play(self, *args, **kwargs):
+        self.bank.play_tone(self.key)
+
+    def stop(self):
+        self.bank.stop_tone(self.key)
+
+    def get_volume(self):
+        return float(self.bank.amplitudes[self.key])
+
+    def set_volume(self, volume):
+        self.bank.set_amplitudes([volume], [self.key])
+
+    def __repr__(self):
+        return '{cls}({frequency} Hz)'.format(cls=self.__class__.__name__, frequency=self.frequency)
+
+
+class OfflineToneBank:
+    """
+    Tone bank rendered into NumPy buffers without an audio device.
+
+    Tones are mixed in blocks of `block_size` samples as two float32 matrix-vector products with precomputed sine and
+    cosine tables. Tone phases are derived from the absolute sample position, so independently rendered pieces of the
+    same stream join seamlessly. Amplitude changes are crossfaded over the first block rendered after them.
+
+    If `normalize` is not set raw mix is returned, which is useful when banks are parts of a larger one.
+    """
+    def __init__(self, frequencies, sample_rate, block_size=1024, volume=1., normalize=True):
+        self.frequencies = np.array(frequencies, dtype=np.float64)
+        self.amplitudes = np.full(len(frequencies), volume, dtype=np.float32)
+        self.on = np.zeros(len(frequencies), dtype=np.bool_)
+
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.normalize = normalize
+        # Absolute position of the next rendered sample
+        self.position = 0
+
+        self.omega = 2 * np.pi * self.frequencies / sample_rate
+        phases = self.omega.reshape((len(self), 1)) * np.arange(block_size)
+        self.sin_table = np.sin(phases).astype(np.float32)
+        self.cos_table = np.cos(phases).astype(np.float32)
+        self.ramp = np.linspace(0, 1, block_size, endpoint=False, dtype=np.float32)
+
+        # Scaled amplitudes of the previously rendered block
+        self.rendered_amplitudes = None
+
+    def get_scaled_amplitudes(self):
+        amplitudes = self.amplitudes * self.on
+        if not self.normalize:
+            return amplitudes
+        return amplitudes / (np.abs(amplitudes).sum() + 1) ** .5
+
+    def mix(self, amplitudes, out):
+        """Mixes a block of tones with given amplitudes starting at the current position."""
+        size = len(out)
+        phases = (self.omega * self.position) % (2 * np.pi)
+        # sin(phase + wn) = sin(phase) cos(wn) + cos(phase) sin(wn)
+        np.dot(amplitudes * np.sin(phases).astype(np.float32), self.cos_table[:, :size], out=out)
+        out += np.dot(amplitudes * np.cos(phases).astype(np.float32), self.sin_table[:, :size])
+
+    def render(self, n_samples):
+        """Renders next `n_samples` of the stream as float32 samples in [-1, 1]."""
+        output = np.empty(n_samples, dtype=np.float32)
+        amplitudes = self.get_scaled_amplitudes()
+
+        for start in range(0, n_samples, self.block_size):
+            block = output[start:start + self.block_size]
+            self.mix(amplitudes, block)
+
+            if self.rendered_amplitudes is not None and not np.array_equal(amplitudes, self.rendered_amplitudes):
+                previous = np.empty_like(block)
+                self.mix(self.rendered_amplitudes, previous)
+                ramp = self.ramp[:len(block)]
+                block *= ramp
+                block += previous * (1 - ramp)
+            self.rendered_amplitudes = amplitudes
+
+            self.position += len(block)
+
+        if self.normalize:
+            np.clip(output, -1, 1, out=output)
+
+        return output
+
+    def seek(self, position):
+        self.position = position
+
+    def play(self):
+        self.on[:] = True
+
+    def stop(self):
+        self.on[:] = False
+
+    def set_amplitudes(self, values, keys=None):
+        if keys is None:
+            self.amplitudes[:] = values
+        else:
+            self.amplitudes[np.asarray(keys)] = values
+
+    def play_tone(self, key):
+        self.on[key] = True
+
+    def stop_tone(self, key):
+        self.on[key] = False
+
+    def __getitem__(self, item):
+        return OfflineTone(self, item)
+
+    def __len__(self):
+        return len(self.frequencies)
+
+
+class OfflineSynth(Synth):
+    """Synth which renders tones into NumPy buffers faster than real time instead of playing them."""
+    def __init__(self, base=440, octaves=3, levels=16, shift=-12, block_size=1024):
+        self.levels = levels
+        self.frequencies = get_frequencies(base, octaves, self.levels, shift)
+        self.sample_rate = _offline_state.sample_rate
+
+        self.tones = OfflineToneBank(self.frequencies, self.sample_rate, block_size=block_size)
+        logger.info('All tones initialized.')
+
+    def play(self, key=None):
+        if key is not None:
+            self.tones.play_tone(key)
+            logger.debug('Start to play {} tone.'.format(self.tones[key]))
+        else:
+            self.tones.play()
+            logger.info('All tones are ready and playing.')
+
+    def stop(self, key=None):
+        if key is not None:
+            self.tones.stop_tone(key)
+            logger.debug('Stop to play {} tone.'.format(self.tones[key]))
+        else:
+            self.tones.stop()
+            logger.info('All tones stopped.')
+
+    def silence(self):
+        self.tones.set_amplitudes(0)
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        self.tones.set_amplitudes(volumes, keys)
+
+    def render(self, n_samples):
+        return self.tones.render(n_samples)
+
+    def seek(self, position):
+        self.tones.seek(position)
+
+    def __getitem__(self, item):
+        return self.tones[item].get_volume()
+
+    def __setitem__(self, key, value):
+        self.tones.set_amplitudes([value], [key])
+
+    def __len__(self):
+        return len(self.tones)
@@ -1,8 +1,10 @@
+import time
+
 import numpy as np
 import numpy.fft as fft
 import pyaudio
-from collections import deque
 
+from acoustic_sight.hilbert_curve import is_power_of_2
 from acoustic_sight.synth import Synth, get_frequencies
 from acoustic_sight.tools import get_logger
 
@@ -46,37 +48,6 @@ def get_frequency_space(frame_size, sample_rate, fft_type=RFFT):
     return freq_function(frame_size, 1 / sample_rate)
 
 
-def check_frequencies_order(frequencies):
-    last_freq = frequencies[0]
-    for f in frequencies:
-        if f < last_freq:
-            raise ValueError('Frequencies passed in non-ascendant order: {last_freq} id followed by {f}'
-                             .format(last_freq=last_freq, f=f))
-        else:
-            last_freq = f
-
-
-def get_frequency_map(frequencies, frequency_space):
-    idx_map = dict()
-
-    check_frequencies_order(frequencies)
-
-    last_idx = 0
-    for f in frequencies:
-        idx_map[f] = last_idx
-        for fs_i in range(last_idx, len(frequency_space)):
-            if abs(frequency_space[fs_i] - f) <= abs(frequency_space[idx_map[f]] - f):
-                idx_map[f] = fs_i
-            else:
-                last_idx = idx_map[f]
-                break
-            last_idx = idx_map[f]
-
-    value_map = {f: frequency_space[idx] for f, idx in idx_map.items()}
-
-    return idx_map, value_map
-
-
 def get_top_frequencies(fs_signal, frequency_space, n=1):
     top_idx = np.abs(fs_signal).argsort()[-n:][::-1]
     top_frequencies = np.zeros(n, dtype=frequency_space.dtype)
@@ -99,45 +70,154 @@ class PATone:
         self.amplitude = value
 
 
-def get_freq_space_signal(tones: [PATone], frequency_space: [float], frequency_idx_map, scale=1.):
-    freq_space_signal = np.zeros(len(frequency_space), dtype=np.complex128)
-    for t in tones:
-        if t.on:
-            freq_idx = frequency_idx_map[t.frequency]
-            freq_space_signal[freq_idx] = t.amplitude * scale
+def get_frequency_bins(frequencies, frame_size, sample_rate):
+    """Returns indexes of real FFT bins nearest to the given frequencies."""
+    bins = np.rint(np.asarray(frequencies, dtype=np.float64) * frame_size / sample_rate).astype(np.intp)
+    return np.clip(bins, 0, frame_size // 2)
+
+
+class PAToneState:
+    """
+    Amplitudes and on/off flags of all tones, and wall-clock time amplitudes should be heard at (if scheduled).
+
+    Amplitudes and on/off flags are published through separate channels and are copied separately.
+    """
+    def __init__(self, size, volume=1.):
+        self.amplitudes = np.full(size, volume, dtype=np.float64)
+        self.on = np.zeros(size, dtype=np.bool_)
+        self.amplitude_sum = float(np.abs(self.amplitudes).sum())
+        self.timestamp = None
+        # Odd while the state is being rewritten
+        self.version = 0
+        # Number of the publication this state holds
+        self.sequence = 0
 
-    return freq_space_signal
+    def copy_amplitudes(self, other):
+        np.copyto(self.amplitudes, other.amplitudes)
+        self.amplitude_sum = other.amplitude_sum
+        self.timestamp = other.timestamp
+
+    def copy_on(self, other):
+        np.copyto(self.on, other.on)
 
 
 class PAMultiTone:
-    def __init__(self, frequencies, volume=1., fft_type=RFFT):
-        self.task_queue = deque()
+    # Stream buffer size, PyAudio default is used if not specified
+    frames_per_buffer = None
+    # Maximum number of amplitude updates waiting for their time, the latest one is replaced when the queue is full
+    queue_size = 16
 
-        self.tones = [PATone(frequency=f, amplitude=volume, on=False) for f in frequencies]
+    def __init__(self, frequencies, volume=1., fft_type=RFFT, frame_size=None):
+        self.frequencies = np.array(frequencies, dtype=np.float64)
         self.volume = volume
 
+        # Tone state is updated by the control thread in the back buffer. Snapshots of amplitudes are published to the
+        # audio thread through a ring queue in order and applied at their scheduled sample, while on/off flags are
+        # published immediately by swapping front reference of a double buffer. The audio thread renders from its own
+        # copy, so updates never allocate or block it.
+        self._back = PAToneState(len(frequencies), volume)
+        self._queue = [PAToneState(len(frequencies), volume) for _ in range(self.queue_size)]
+        self._queued = 0
+        self._applied = 0
+        # Amplitudes were set in the back buffer by `set_amplitude()` and are not published yet
+        self._pending = False
+        self._switches = (PAToneState(len(frequencies), volume), PAToneState(len(frequencies), volume))
+        self._switch_front = self._switches[0]
+        self._switched = 0
+
+        self._rendered = PAToneState(len(frequencies), volume)
+        # Samples of callbacks split at the moment of scheduled update
+        self._output = np.zeros(0, dtype=np.float32)
+
         self.bitrate = _pa_state.bitrate
-        self.frame_size = int(self.bitrate)
+        self.frame_size = int(frame_size or self.bitrate)
 
         self.frequency_space = get_frequency_space(frame_size=self.frame_size, sample_rate=self.bitrate)
-        self.frequency_idx_map, _ = get_frequency_map(frequencies, self.frequency_space)
+        self.frequency_bins = get_frequency_bins(self.frequencies, self.frame_size, self.bitrate)
 
+        if fft_type not in (RFFT, FFT):
+            raise ValueError('Unsupported FFT type: %s.' % fft_type)
         self.fft_type = fft_type
 
+        self._dirty = True
+        self._init_buffers()
+
         self.stream = self._get_stream()
 
-    def _flush_queue(self):
-        while len(self.task_queue):
-            task = self.task_queue.pop()
-            fn_name = task[0]
-            args = task[1:]
-            func = getattr(self, fn_name)
-            func(*args)
+    def _init_buffers(self):
+        # Synthesized period is stored twice in a row, so every window is a contiguous slice
+        self.period = np.zeros(2 * self.frame_size, dtype=np.float32)
+
+    def _publish(self, timestamp=None):
+        """Queues snapshot of back buffer amplitudes to be played at `timestamp` (as soon as possible if None)."""
+        self._back.timestamp = timestamp
+
+        if self._queued - self._applied < len(self._queue):
+            state = self._queue[self._queued % len(self._queue)]
+            replace = False
+        else:
+            # Audio thread is lagging behind, the latest update is replaced instead of the oldest one being lost
+            state = self._queue[(self._queued - 1) % len(self._queue)]
+            replace = True
+
+        # Version is odd while the state is being rewritten
+        state.version += 1
+        state.copy_amplitudes(self._back)
+        state.version += 1
+
+        if not replace:
+            self._queued += 1
+        self._pending = False
+
+    def _publish_switches(self):
+        """Copies on/off flags of back buffer to the inactive front buffer and swaps them."""
+        state = self._switches[1] if self._switch_front is self._switches[0] else self._switches[0]
+
+        state.version += 1
+        state.copy_on(self._back)
+        self._switched += 1
+        state.sequence = self._switched
+        state.version += 1
+
+        self._switch_front = state
+
+    def _acquire_switches(self):
+        """Takes the latest published on/off flags for rendering. Called from the audio thread."""
+        state = self._switch_front
+        if state.sequence == self._rendered.sequence:
+            return
+
+        version = state.version
+        if version % 2:
+            return
+        self._rendered.copy_on(state)
+        sequence = state.sequence
+        self._dirty = True
+
+        # State was rewritten while copying, will retry on the next callback
+        if state.version != version:
+            self._rendered.sequence = -1
+            return
+
+        self._rendered.sequence = sequence
+
+    def _apply(self, state):
+        """Applies queued amplitudes for rendering, returns False if they were being rewritten (audio thread)."""
+        version = state.version
+        if version % 2:
+            return False
+        self._rendered.copy_amplitudes(state)
+        self._dirty = True
+
+        return state.version == version
 
     def _get_stream(self):
         def stream_callback(in_data, frame_count, time_info, status):
-            self._flush_queue()
-            return self._get_samples(frame_count, time_info['output_buffer_dac_time']), pyaudio.paContinue
+            return self._render(frame_count, time_info), pyaudio.paContinue
+
+        stream_options = dict()
+        if self.frames_per_buffer is not None:
+            stream_options['frames_per_buffer'] = self.frames_per_buffer
 
         return _pa_state.pa_instance.open(
             format=pyaudio.paFloat32,
@@ -145,89 +225,229 @@ class PAMultiTone:
             rate=_pa_state.bitrate,
             output=True,
             stream_callback=stream_callback,
+            **stream_options
         )
 
-    def _get_samples(self, frame_count, time_base):
-        freq_space_signal = get_freq_space_signal(tones=self.tones,
-                                                  frequency_space=self.frequency_space,
-                                                  frequency_idx_map=self.frequency_idx_map,
-                                                  scale=self.frame_size / len(self.tones),
-                                                  )
+    def _get_update_offset(self, state, frame_count, time_info):
+        """
+        Returns offset of the sample in the current callback from which queued state should be played.
+
+        Unscheduled states are applied immediately, while states scheduled after the current callback wait for later
+        callbacks (None is returned).
+        """
+        timestamp = state.timestamp
+        if timestamp is None:
+            return 0
+
+        # Convert wall-clock time to the stream time
+        stream_time = timestamp - (time.time() - time_info['current_time'])
+        offset = int(round((stream_time - time_info['output_buffer_dac_time']) * self.bitrate))
+
+        if offset >= frame_count:
+            return None
+        return max(offset, 0)
+
+    def _render(self, frame_count, time_info):
+        time_base = time_info['output_buffer_dac_time']
+        self._acquire_switches()
+
+        # Callback is split at the moments of queued updates, samples before them are played with previous states
+        output = None
+        position = 0
+        while self._applied < self._queued:
+            state = self._queue[self._applied % len(self._queue)]
+            offset = self._get_update_offset(state, frame_count, time_info)
+            if offset is None:
+                break
+
+            if offset > position:
+                if output is None:
+                    if len(self._output) < frame_count:
+                        self._output = np.zeros(frame_count, dtype=np.float32)
+                    output = self._output[:frame_count]
+                output[position:offset] = self._get_samples(offset - position, time_base + position / self.bitrate)
+                position = offset
+
+            # State is being rewritten, will retry on the next callback
+            if not self._apply(state):
+                break
+            self._applied += 1
+
+        if output is None:
+            return self._get_samples(frame_count, time_base)
+
+        output[position:] = self._get_samples(frame_count - position, time_base + position / self.bitrate)
+        return output
+
+    def _synthesize(self):
+        """Recomputes cached signal period from current amplitudes."""
+        weights = self._rendered.amplitudes * self._rendered.on * (self.frame_size / len(self))
+        # Tones which fall into the same bin are summed up
+        freq_space_signal = np.bincount(self.frequency_bins, weights=weights, minlength=len(self.frequency_space))
 
         if self.fft_type == RFFT:
-            inverse_fft_function = fft.irfft
-        elif self.fft_type == FFT:
-            inverse_fft_function = fft.ifft
+            signal = fft.irfft(freq_space_signal, self.frame_size)
         else:
-            raise ValueError('Unsupported FFT type: %s.' % self.fft_type)
+            signal = fft.ifft(freq_space_signal, self.frame_size).real
+
+        signal *= self.volume * self.get_scale_factor()
 
-        signal = inverse_fft_function(freq_space_signal, self.frame_size)
+        self.period[:self.frame_size] = signal
+        self.period[self.frame_size:] = signal
+        self._dirty = False
+
+    def _get_samples(self, frame_count, time_base):
+        if self._dirty:
+            self._synthesize()
 
         start = int((time_base % (self.bitrate / self.frame_size)) * self.bitrate) % self.frame_size
         stop = start + frame_count
 
-        if stop < len(signal):
-            window = signal[start:stop]
+        if stop <= len(self.period):
+            return self.period[start:stop]
         else:
-            window = np.concatenate((signal[start:], signal[:stop - len(signal)]))
-
-        scaled_window = window.real * self.volume * self.get_scale_factor()
-
-        return scaled_window.astype(np.float32)
+            return np.take(self.period[:self.frame_size], np.arange(start, stop), mode='wrap')
 
     def get_scale_factor(self):
-        return 1 / (sum([abs(t.amplitude) for t in self.tones]) + 1) ** .5
+        return 1 / (self._rendered.amplitude_sum + 1) ** .5
 
     def play(self):
-        for t in range(len(self.tones)):
-            self.play_tone(t)
+        self._back.on[:] = True
+        self._publish_switches()
 
         self.stream.start_stream()
 
     def stop(self):
         self.stream.stop_stream()
 
-    def _set_amplitude(self, key, value):
-        self.tones[key].amplitude = value
-
     def set_amplitude(self, key, value):
-        self.task_queue.append(('_set_amplitude', key, value))
-        self._set_amplitude(key, value)
+        """Sets amplitude in the back buffer, it is published by the next `sync()` or `set_amplitudes()`."""
+        self._back.amplitude_sum += abs(value) - abs(self._back.amplitudes[key])
+        self._back.amplitudes[key] = value
+        self._pending = True
+
+    def sync(self):
+        """Publishes amplitudes set one by one since the last publication as a single update."""
+        if self._pending:
+            self._publish()
+
+    def set_amplitudes(self, values, keys=None, timestamp=None):
+        back = self._back
+        if keys is None:
+            back.amplitudes[:] = values
+            back.amplitude_sum = float(np.abs(back.amplitudes).sum())
+        else:
+            back.amplitude_sum += float(np.abs(values).sum() - np.abs(back.amplitudes[keys]).sum())
+            back.amplitudes[keys] = values
+        self._publish(timestamp)
 
     def get_amplitude(self, key):
-        return self.tones[key].amplitude
-
-    def _play_tone(self, key):
-        self.tones[key].on = True
+        return self._back.amplitudes[key]
 
     def play_tone(self, key):
-        self.task_queue.append(('_play_tone', key))
-        self._play_tone(key)
-
-    def _stop_tone(self, key):
-        self.tones[key].on = False
+        self._back.on[key] = True
+        self._publish_switches()
 
     def stop_tone(self, key):
-        self.task_queue.append(('play_tone', key))
-        self._stop_tone(key)
+        self._back.on[key] = False
+        self._publish_switches()
 
     def __getitem__(self, item):
-        return self.tones[item]
+        return PATone(frequency=self.frequencies[item], amplitude=self._back.amplitudes[item], on=self._back.on[item])
 
     def __len__(self):
-        return len(self.tones)
+        return len(self.frequencies)
 
     def __del__(self):
         self.stream.close()
 
 
+class PABlockMultiTone(PAMultiTone):
+    """
+    Multi tone which synthesizes short blocks with overlap-add.
+
+    Tones are snapped to FFT bins of `block_size` (a power of two, 256 to 2048 samples is recommended). Each block
+    costs a single small real IFFT. Blocks are Hann windowed with 50% overlap, so amplitude changes are crossfaded
+    between consecutive blocks and latency is bounded by the block size. Scheduled updates start from the first hop
+    rendered after their time.
+    """
+    def __init__(self, frequencies, volume=1., block_size=1024):
+        if not is_power_of_2(block_size):
+            raise ValueError('Block size should be a power of 2 but {} is given.'.format(block_size))
+
+        self.hop_size = block_size // 2
+        self.frames_per_buffer = self.hop_size
+
+        super().__init__(frequencies, volume=volume, fft_type=RFFT, frame_size=block_size)
+
+    def _init_buffers(self):
+        # Periodic Hann window sums up to one with 50% overlap
+        self.window = (.5 - .5 * np.cos(2 * np.pi * np.arange(self.frame_size) / self.frame_size))
+        # Phase of a bin-centered tone alternates every hop for odd bins
+        self.hop_signs = np.where(np.arange(len(self.frequency_space)) % 2, -1., 1.)
+
+        self.spectrum = np.zeros(len(self.frequency_space), dtype=np.float64)
+        self.alternated_spectrum = np.zeros(len(self.frequency_space), dtype=np.float64)
+        self.block = np.zeros(self.frame_size, dtype=np.float64)
+        self.tail = np.zeros(self.hop_size, dtype=np.float64)
+        self.block_index = 0
+
+        self.buffer = np.zeros(2 * self.hop_size, dtype=np.float32)
+        self.available = 0
+        self.consumed = 0
+
+    def _synthesize(self):
+        """Recomputes block spectrum from current amplitudes."""
+        weights = self._rendered.amplitudes * self._rendered.on * (self.frame_size / len(self))
+        self.spectrum[:] = np.bincount(self.frequency_bins, weights=weights, minlength=len(self.spectrum))
+        self.spectrum *= self.volume * self.get_scale_factor()
+        np.multiply(self.spectrum, self.hop_signs, out=self.alternated_spectrum)
+        self._dirty = False
+
+    def _render_hop(self, out):
+        if self._dirty:
+            self._synthesize()
+
+        spectrum = self.alternated_spectrum if self.block_index % 2 else self.spectrum
+        self.block[:] = fft.irfft(spectrum, self.frame_size)
+        self.block *= self.window
+
+        np.add(self.tail, self.block[:self.hop_size], out=out, casting='unsafe')
+        self.tail[:] = self.block[self.hop_size:]
+        self.block_index += 1
+
+    def _get_samples(self, frame_count, time_base):
+        # Move samples left from the previous callback to the beginning of the buffer
+        if self.consumed:
+            left = self.available - self.consumed
+            self.buffer[:left] = self.buffer[self.consumed:self.available]
+            self.available = left
+            self.consumed = 0
+
+        if len(self.buffer) < frame_count + self.hop_size:
+            buffer = np.zeros(frame_count + self.hop_size, dtype=np.float32)
+            buffer[:self.available] = self.buffer[:self.available]
+            self.buffer = buffer
+
+        while self.available < frame_count:
+            self._render_hop(self.buffer[self.available:self.available + self.hop_size])
+            self.available += self.hop_size
+
+        self.consumed = frame_count
+
+        return self.buffer[:frame_count]
+
+
 class PASynth(Synth):
     def __init__(self, base=440, octaves=3, levels=16, shift=-12):
         self.levels = levels
         self.tones = [None] * self.levels
         self.frequencies = get_frequencies(base, octaves, self.levels, shift)
 
-        self.tones = PAMultiTone(self.frequencies)
+        self.tones = self.get_multi_tone(self.frequencies)
+
+    def get_multi_tone(self, frequencies):
+        return PAMultiTone(frequencies)
 
     def play(self, key=None):
         if key is not None:
@@ -251,6 +471,15 @@ class PASynth(Synth):
     def __setitem__(self, key, value):
         self.tones.set_amplitude(key, value)
 
+    def silence(self):
+        self.tones.set_amplitudes(np.zeros(len(self.tones)))
+
+    def sync(self):
+        self.tones.sync()
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        self.tones.set_amplitudes(volumes, keys, timestamp=timestamp)
+
     def __len__(self):
         return len(self.tones)
 
@@ -258,10 +487,20 @@ class PASynth(Synth):
         self.stop()
 
 
+class PABlockSynth(PASynth):
+    def get_multi_tone(self, frequencies):
+        return PABlockMultiTone(frequencies)
+
+
 def test():
     from acoustic_sight.sound_drivers.test_run import test_run
     test_run(init_audio, PASynth)
 
 
+def block_test():
+    from acoustic_sight.sound_drivers.test_run import test_run
+    test_run(init_audio, PABlockSynth)
+
+
 if __name__ == "__main__":
     test()
@@ -1,15 +1,22 @@
+import hashlib
 import math
+import os
+import threading
+import time
 
 import numpy
 import pygame
 
-from acoustic_sight.synth import Synth
-from acoustic_sight.tools import get_logger
+from acoustic_sight.synth import Synth, get_frequencies
+from acoustic_sight.tools import CACHE_DIR, get_logger, load_array, save_array
 
 
 logger = get_logger('pg_tools')
 
 
+TONE_CACHE_VERSION = 1
+
+
 def init_audio(frequency=22050*4, channels=1):
     logger.debug('Initializing PyGame mixer...')
     pygame.mixer.pre_init(frequency, -16, channels, 2 ** 12)
@@ -36,10 +43,81 @@ def get_tone_samples_array(frequency, repeat=10, time_shift=0.):
     return signal.astype(numpy.int16)
 
 
+def get_loop_lengths(frequencies, sample_rate, tolerance=1e-3, max_periods=100):
+    """
+    Returns loop lengths in samples and numbers of periods they hold.
+
+    Loop holds the smallest number of whole periods (up to `max_periods`) which fits into an integer number of
+    samples, so that the looped tone deviates from its frequency by less than `tolerance` (relative error, 1e-3 is
+    about 2 cents).
+    """
+    frequencies = numpy.asarray(frequencies, dtype=numpy.float64).reshape((-1, 1))
+    periods = numpy.arange(1, max_periods + 1, dtype=numpy.float64).reshape((1, -1))
+
+    lengths = numpy.rint(periods * sample_rate / frequencies)
+    # Phase error accumulated over the loop is spread over all periods it holds
+    errors = numpy.abs(lengths * frequencies / sample_rate - periods) / periods
+
+    # The first candidate within tolerance, or the most accurate one if none fits
+    fits = errors <= tolerance
+    choice = numpy.where(fits.any(axis=1), fits.argmax(axis=1), errors.argmin(axis=1))
+    rows = numpy.arange(len(frequencies))
+
+    return lengths[rows, choice].astype(numpy.int64), periods[0, choice].astype(numpy.int64)
+
+
+def build_tone_buffers(frequencies, sample_rate, max_amplitude, tolerance=1e-3):
+    """
+    Synthesizes seamless loop buffers of all tones in one pass.
+
+    Returns concatenated int16 samples and offsets of each tone buffer (`len(frequencies) + 1` values).
+    """
+    lengths, periods = get_loop_lengths(frequencies, sample_rate, tolerance=tolerance)
+    offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+
+    tone_idx = numpy.repeat(numpy.arange(len(lengths)), lengths)
+    positions = numpy.arange(offsets[-1]) - offsets[tone_idx]
+    # Every loop holds exactly a whole number of periods, so it never clicks at the loop point
+    signal = numpy.sin(2 * numpy.pi * periods[tone_idx] * positions / lengths[tone_idx]) * max_amplitude
+
+    return signal.astype(numpy.int16), offsets
+
+
+def get_tone_buffers(frequencies, tolerance=1e-3, cache_dir=CACHE_DIR):
+    """
+    Returns list of loop buffers for all tones.
+
+    Buffers are persisted in memory-mapped cache keyed by mixer sample rate, bit depth and frequency table.
+    """
+    sample_rate, bits, *_ = pygame.mixer.get_init()
+    key = hashlib.sha1(numpy.asarray(frequencies, dtype=numpy.float64).tobytes() + repr(tolerance).encode())
+    path_template = os.path.join(cache_dir, 'pg-tones-v{version}-{sample_rate}-{bits}-{key}-{{name}}.npy'.format(
+        version=TONE_CACHE_VERSION, sample_rate=sample_rate, bits=abs(bits), key=key.hexdigest()))
+
+    samples = load_array(path_template.format(name='samples'))
+    offsets = load_array(path_template.format(name='offsets'))
+
+    if samples is None or offsets is None or len(offsets) != len(frequencies) + 1:
+        samples, offsets = build_tone_buffers(frequencies, sample_rate, get_max_amplitude(), tolerance=tolerance)
+        logger.debug('Synthesized loop buffers for {n} tones.'.format(n=len(frequencies)))
+        try:
+            samples = save_array(samples, path_template.format(name='samples'))
+            offsets = save_array(offsets, path_template.format(name='offsets'))
+        except OSError as e:
+            logger.warning('Failed to cache tone buffers to {path}: {e}'.format(path=cache_dir, e=e))
+    else:
+        logger.debug('Loaded cached loop buffers for {n} tones.'.format(n=len(frequencies)))
+
+    offsets = numpy.asarray(offsets).tolist()
+
+    return [samples[offsets[i]:offsets[i + 1]] for i in range(len(frequencies))]
+
+
 class PGTone(pygame.mixer.Sound):
-    def __init__(self, frequency, volume=.1):
+    def __init__(self, frequency, volume=.1, samples=None):
         self.frequency = frequency
-        super().__init__(buffer=self.build_samples())
+        super().__init__(buffer=self.build_samples() if samples is None else samples)
         self.set_volume(volume)
 
     def build_samples(self):
@@ -49,10 +127,182 @@ class PGTone(pygame.mixer.Sound):
 class PGSynth(Synth):
     def __init__(self, base=440, octaves=3, levels=16, shift=-12):
         pygame.mixer.set_num_channels(levels)
+
+        frequencies = get_frequencies(base, octaves, levels, shift)
+        self.tone_buffers = dict(zip(frequencies, get_tone_buffers(frequencies)))
+
         super().__init__(base=base, octaves=octaves, levels=levels, shift=shift)
 
     def get_tone(self, frequency):
-        return PGTone(frequency=frequency, volume=1/self.levels)
+        return PGTone(frequency=frequency, volume=1/self.levels, samples=self.tone_buffers.get(frequency))
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        tones = self.tones if keys is None else [self.tones[key] for key in numpy.asarray(keys).tolist()]
+        for tone, volume in zip(tones, numpy.asarray(volumes, dtype=numpy.float32).tolist()):
+            tone.set_volume(volume)
+
+
+class PGMixTone:
+    """Tone view to a single oscillator of PGToneBank."""
+    def __init__(self, bank, key):
+        self.bank = bank
+        self.key = key
+        self.frequency = bank.frequencies[key]
+
+    def play(self, *args, **kwargs):
+        self.bank.play_tone(self.key)
+
+    def stop(self):
+        self.bank.stop_tone(self.key)
+
+    def get_volume(self):
+        return float(self.bank.amplitudes[self.key])
+
+    def set_volume(self, volume):
+        self.bank.set_amplitudes([volume], [self.key])
+
+    def __repr__(self):
+        return '{cls}({frequency} Hz)'.format(cls=self.__class__.__name__, frequency=self.frequency)
+
+
+class PGToneBank:
+    """
+    Tone bank mixed in NumPy into a single stream.
+
+    Chunks of `chunk_size` samples are mixed as two float32 matrix-vector products with precomputed sine and cosine
+    tables, normalized once and fed to a single mixer channel. The next chunk is always queued while the current one
+    plays, so the number of SDL channels doesn't depend on the number of tones.
+    """
+    def __init__(self, frequencies, chunk_size=2048, volume=1., channel_id=0):
+        self.frequencies = numpy.array(frequencies, dtype=numpy.float64)
+        self.amplitudes = numpy.full(len(frequencies), volume, dtype=numpy.float32)
+        self.on = numpy.zeros(len(frequencies), dtype=numpy.bool_)
+
+        self.sample_rate = pygame.mixer.get_init()[0]
+        self.channels = pygame.mixer.get_init()[2]
+        self.chunk_size = chunk_size
+        self.chunk_duration = chunk_size / self.sample_rate
+        self.max_amplitude = get_max_amplitude()
+
+        omega = (2 * numpy.pi * self.frequencies / self.sample_rate).reshape((len(self), 1))
+        phases = omega * numpy.arange(chunk_size)
+        self.sin_table = numpy.sin(phases).astype(numpy.float32)
+        self.cos_table = numpy.cos(phases).astype(numpy.float32)
+        # Tone phases at the beginning of the next chunk and their advance per chunk
+        self.phases = numpy.zeros(len(self), dtype=numpy.float64)
+        self.phase_step = (omega.reshape((len(self),)) * chunk_size) % (2 * numpy.pi)
+
+        self.mixed = numpy.zeros(chunk_size, dtype=numpy.float32)
+
+        self.channel = pygame.mixer.Channel(channel_id)
+        self._thread = None
+        self._playing = False
+
+    def mix(self):
+        """Mixes next chunk of all tones and returns it as int16 samples."""
+        amplitudes = self.amplitudes * self.on
+        # sin(phase + wn) = sin(phase) cos(wn) + cos(phase) sin(wn)
+        numpy.dot(amplitudes * numpy.sin(self.phases).astype(numpy.float32), self.cos_table, out=self.mixed)
+        self.mixed += numpy.dot(amplitudes * numpy.cos(self.phases).astype(numpy.float32), self.sin_table)
+        self.phases = (self.phases + self.phase_step) % (2 * numpy.pi)
+
+        self.mixed *= self.max_amplitude / (numpy.abs(amplitudes).sum() + 1) ** .5
+        numpy.clip(self.mixed, -self.max_amplitude, self.max_amplitude, out=self.mixed)
+
+        samples = self.mixed.astype(numpy.int16)
+        if self.channels > 1:
+            samples = numpy.repeat(samples.reshape((self.chunk_size, 1)), self.channels, axis=1)
+
+        return samples
+
+    def next_sound(self):
+        return pygame.mixer.Sound(buffer=self.mix())
+
+    def _feed(self):
+        while self._playing:
+            if self.channel.get_queue() is None:
+                self.channel.queue(self.next_sound())
+            time.sleep(self.chunk_duration / 4)
+
+    def _start(self):
+        if not self._playing:
+            self._playing = True
+            self.channel.play(self.next_sound())
+            self.channel.queue(self.next_sound())
+            self._thread = threading.Thread(target=self._feed, daemon=True)
+            self._thread.start()
+
+    def play(self):
+        self.on[:] = True
+        self._start()
+
+    def stop(self):
+        if self._playing:
+            self._playing = False
+            self._thread.join()
+            self.channel.stop()
+
+    def set_amplitudes(self, values, keys=None):
+        if keys is None:
+            self.amplitudes[:] = values
+        else:
+            self.amplitudes[numpy.asarray(keys)] = values
+
+    def play_tone(self, key):
+        self.on[key] = True
+        self._start()
+
+    def stop_tone(self, key):
+        self.on[key] = False
+
+    def __getitem__(self, item):
+        return PGMixTone(self, item)
+
+    def __len__(self):
+        return len(self.frequencies)
+
+
+class PGMixSynth(Synth):
+    """PyGame synth which mixes all tones in NumPy and plays them through a single mixer channel."""
+    def __init__(self, base=440, octaves=3, levels=16, shift=-12, chunk_size=2048):
+        pygame.mixer.set_num_channels(1)
+
+        self.levels = levels
+        self.frequencies = get_frequencies(base, octaves, self.levels, shift)
+
+        self.tones = PGToneBank(self.frequencies, chunk_size=chunk_size)
+        logger.info('All tones initialized.')
+
+    def play(self, key=None):
+        if key is not None:
+            self.tones.play_tone(key)
+            logger.debug('Start to play {} tone.'.format(self.tones[key]))
+        else:
+            self.tones.play()
+            logger.info('All tones are ready and playing.')
+
+    def stop(self, key=None):
+        if key is not None:
+            self.tones.stop_tone(key)
+            logger.debug('Stop to play {} tone.'.format(self.tones[key]))
+        else:
+            self.tones.stop()
+            logger.info('All tones stopped.')
+
+    def silence(self):
+        self.tones.set_amplitudes(0)
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        self.tones.set_amplitudes(volumes, keys)
+
+    def __getitem__(self, item):
+        return self.tones[item].get_volume()
+
+    def __setitem__(self, key, value):
+        self.tones.set_amplitudes([value], [key])
+
+    def __len__(self):
+        return len(self.tones)
 
 
 def test():
@@ -60,5 +310,10 @@ def test():
     test_run(init_audio, PGSynth)
 
 
+def mix_test():
+    from acoustic_sight.sound_drivers.test_run import test_run
+    test_run(init_audio, PGMixSynth)
+
+
 if __name__ == "__main__":
     test()
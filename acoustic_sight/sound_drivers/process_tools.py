@@ -0,0 +1,186 @@
+import multiprocessing
+
+import numpy as np
+
+from acoustic_sight import sound_drivers
+from acoustic_sight.synth import Synth, get_frequencies
+from acoustic_sight.tools import get_logger
+
+
+logger = get_logger('process_tools')
+
+
+# Header fields of the shared state
+SEQUENCE = 0
+RUNNING = 1
+QUEUED = 2
+
+# Number of amplitude updates the audio process may lag behind before the oldest ones are skipped
+QUEUE_SIZE = 16
+
+# Audio process checks shared state at least this often (seconds)
+POLL_INTERVAL = .05
+
+
+def run_synth_process(synth_type, levels, octaves, shift, header, timestamps, amplitudes, on, updated):
+    """Runs sound driver and applies amplitudes published by the parent process until it is asked to exit."""
+    Synth, init_audio = sound_drivers.get_driver(synth_type)
+    init_audio()
+    synth = Synth(levels=levels, octaves=octaves, shift=shift)
+
+    control = np.frombuffer(header, dtype=np.int64)
+    shared_amplitudes = np.frombuffer(amplitudes, dtype=np.float32).reshape((QUEUE_SIZE, levels))
+    shared_on = np.frombuffer(on, dtype=np.int8)
+    shared_timestamps = np.frombuffer(timestamps, dtype=np.float64)
+
+    local_amplitudes = np.zeros(levels, dtype=np.float32)
+    local_on = np.zeros(levels, dtype=np.int8)
+    sent_amplitudes = np.full(levels, np.nan, dtype=np.float32)
+    played = np.zeros(levels, dtype=np.int8)
+    last_sequence = 0
+    applied = 0
+
+    try:
+        while control[RUNNING]:
+            updated.wait(POLL_INTERVAL)
+            updated.clear()
+
+            # Every queued amplitude update is forwarded in order, so none of the scheduled ones is lost
+            updates = 0
+            queued = int(control[QUEUED])
+            applied = max(applied, queued - QUEUE_SIZE + 1)
+            while applied < queued:
+                slot = applied % QUEUE_SIZE
+                np.copyto(local_amplitudes, shared_amplitudes[slot])
+                local_timestamp = float(shared_timestamps[slot])
+                applied += 1
+                # Slot was overwritten by a newer update while copying
+                if control[QUEUED] >= applied + QUEUE_SIZE - 1:
+                    continue
+
+                keys = np.flatnonzero(local_amplitudes != sent_amplitudes)
+                if len(keys):
+                    synth.set_volumes(local_amplitudes[keys], keys,
+                                      timestamp=None if np.isnan(local_timestamp) else local_timestamp)
+                    sent_amplitudes[keys] = local_amplitudes[keys]
+                    updates += 1
+
+            # Sequence is odd while parent writes on/off flags
+            sequence = int(control[SEQUENCE])
+            changed = ()
+            if sequence != last_sequence and not sequence % 2:
+                np.copyto(local_on, shared_on)
+                if control[SEQUENCE] == sequence:
+                    last_sequence = sequence
+
+                    changed = np.flatnonzero(local_on != played)
+                    if len(changed) == levels and local_on.all():
+                        synth.play()
+                    else:
+                        for key in changed.tolist():
+                            if local_on[key]:
+                                synth.play(key)
+                            else:
+                                synth.stop(key)
+                    played[changed] = local_on[changed]
+
+            if updates or len(changed):
+                synth.sync()
+    except KeyboardInterrupt:
+        pass
+
+    synth.stop()
+
+
+class SynthProcess(Synth):
+    """
+    Synth proxy which runs a sound driver in a dedicated process.
+
+    Amplitudes and on/off flags are shared with the audio process through shared memory, so realtime audio doesn't
+    compete for the GIL with image processing. Amplitude updates are passed through a ring queue, so updates scheduled
+    ahead are not coalesced, while on/off flags are guarded by a sequence counter.
+    """
+    def __init__(self, synth_type, base=440, octaves=3, levels=16, shift=-12):
+        self.synth_type = synth_type
+        self.levels = levels
+        self.frequencies = get_frequencies(base, octaves, self.levels, shift)
+
+        self._header = multiprocessing.RawArray('q', 3)
+        self._timestamps = multiprocessing.RawArray('d', QUEUE_SIZE)
+        self._amplitudes = multiprocessing.RawArray('f', QUEUE_SIZE * levels)
+        self._on = multiprocessing.RawArray('b', levels)
+        self.control = np.frombuffer(self._header, dtype=np.int64)
+        self.timestamps = np.frombuffer(self._timestamps, dtype=np.float64)
+        self.queue = np.frombuffer(self._amplitudes, dtype=np.float32).reshape((QUEUE_SIZE, levels))
+        self.amplitudes = np.zeros(levels, dtype=np.float32)
+        self.on = np.frombuffer(self._on, dtype=np.int8)
+        self.updated = multiprocessing.Event()
+
+        self.control[RUNNING] = 1
+        self.process = multiprocessing.Process(
+            target=run_synth_process,
+            args=(synth_type, levels, octaves, shift, self._header, self._timestamps, self._amplitudes, self._on,
+                  self.updated),
+            daemon=True,
+        )
+        self.process.start()
+        logger.info('Started {synth_type} synth process: {pid}'.format(synth_type=synth_type, pid=self.process.pid))
+
+    def _begin_update(self):
+        self.control[SEQUENCE] += 1
+
+    def _end_update(self):
+        self.control[SEQUENCE] += 1
+        self.updated.set()
+
+    def play(self, key=None):
+        self._begin_update()
+        if key is None:
+            self.on[:] = 1
+        else:
+            self.on[key] = 1
+        self._end_update()
+
+    def stop(self, key=None):
+        self._begin_update()
+        if key is None:
+            self.on[:] = 0
+        else:
+            self.on[key] = 0
+        self._end_update()
+
+    def silence(self):
+        self.set_volumes(np.zeros(self.levels, dtype=np.float32))
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        if keys is None:
+            self.amplitudes[:] = volumes
+        else:
+            self.amplitudes[np.asarray(keys)] = volumes
+
+        # Audio process reads queued slots only after the counter is incremented
+        queued = int(self.control[QUEUED])
+        slot = queued % QUEUE_SIZE
+        np.copyto(self.queue[slot], self.amplitudes)
+        self.timestamps[slot] = np.nan if timestamp is None else timestamp
+        self.control[QUEUED] = queued + 1
+        self.updated.set()
+
+    def close(self):
+        if self.process.is_alive():
+            self.control[RUNNING] = 0
+            self.updated.set()
+            self.process.join()
+            logger.info('Stopped synth process.')
+
+    def __getitem__(self, item):
+        return float(self.amplitudes[item])
+
+    def __setitem__(self, key, value):
+        self.set_volumes([value], [key])
+
+    def __len__(self):
+        return self.levels
+
+    def __del__(self):
+        self.close()
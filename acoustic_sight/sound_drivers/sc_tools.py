@@ -1,20 +1,127 @@
+import socket
+import time
+
+import numpy as np
 import supriya
 
 from acoustic_sight.tools import get_logger
-from acoustic_sight.synth import Synth
+from acoustic_sight.synth import Synth, get_frequencies
 
 
 logger = get_logger('sc_tools')
 
 
-def init_audio(*args, **kwargs):
+# Encoded bundle size limit (bytes), below the smallest UDP datagram limit in use (9216 bytes on macOS)
+MAX_BUNDLE_BYTES = 8192
+# `#bundle` tag and timetag preceding bundle elements, each prefixed with its size
+BUNDLE_HEADER_BYTES = 16
+BUNDLE_ELEMENT_HEADER_BYTES = 4
+# Number of arguments after the bus index in a single `c_setn` message (bus values) or in `c_set` message (bus index
+# and value pairs), keeps messages about 5 KB encoded
+MAX_BUS_VALUES = 1024
+# Number of oscillators in a single tone bank synth
+BANK_SIZE = 64
+# Delay before tone nodes created in a single bundle start to play (seconds)
+BUNDLE_LATENCY = .05
+
+ADD_TO_TAIL = 1
+
+_tone_synthdef = None
+
+
+def split_bundle_contents(messages, max_bytes=MAX_BUNDLE_BYTES):
+    """Splits messages into lists which encode into bundles not larger than `max_bytes` bytes."""
+    contents = []
+    size = BUNDLE_HEADER_BYTES
+    for message in messages:
+        message_size = BUNDLE_ELEMENT_HEADER_BYTES + len(message.to_datagram())
+        if contents and size + message_size > max_bytes:
+            yield contents
+            contents = []
+            size = BUNDLE_HEADER_BYTES
+        contents.append(message)
+        size += message_size
+
+    if contents:
+        yield contents
+
+
+def send_bundles(server, messages, timestamp=None):
+    """
+    Sends messages in bundles not exceeding `MAX_BUNDLE_BYTES`, all timetagged with `timestamp` if given.
+
+    Returns the number of bundles sent.
+    """
+    bundles = 0
+    for contents in split_bundle_contents(messages):
+        server.send_message(supriya.osctools.OscBundle(timestamp=timestamp, contents=contents))
+        bundles += 1
+
+    return bundles
+
+
+def is_server_running(ip_address='127.0.0.1', port=57110, timeout=.2):
+    """Checks whether scsynth is reachable by sending `/status` OSC message."""
+    message = b'/status\x00' + b',\x00\x00\x00'
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.sendto(message, (ip_address, port))
+            data, _ = sock.recvfrom(1024)
+        except OSError:
+            return False
+
+    return data.startswith(b'/status.reply')
+
+
+def attach_server(server, server_options=None):
+    """
+    Sets supriya server up to control scsynth which is already running.
+
+    supriya 0.1 has no `Server.connect`, so its `Server.boot` is mirrored without starting scsynth process: server is
+    marked as running and its allocators, notifications and default groups are set up.
+    """
+    if hasattr(server, 'connect'):
+        server.connect()
+        return
+
+    if not (hasattr(server, '_is_running') and hasattr(server, '_setup')):
+        raise RuntimeError('SuperCollider server is already running at {ip}:{port}, but installed supriya is unable '
+                           'to attach to it. Stop the server to boot a new one.'
+                           .format(ip=server.ip_address, port=server.port))
+
+    server._server_options = server_options or supriya.servertools.ServerOptions()
+    server._is_running = True
+    try:
+        server._setup()
+    except Exception:
+        server._is_running = False
+        raise
+
+
+def init_audio(*args, attach=True, **kwargs):
     import os
     logger.debug('Patching PATH by adding "/usr/local/bin"...')
     os.environ['PATH'] = '/usr/local/bin:{path}'.format(path=os.environ['PATH'])
 
-    logger.debug('Starting SuperCollider server...')
-    server_options = supriya.servertools.ServerOptions(maximum_synthdef_count=2**16)
     server = supriya.servertools.Server.get_default_server()
+    if server.is_running:
+        logger.info('SuperCollider server is already running: {}'.format(server))
+        return
+
+    if is_server_running(server.ip_address, server.port):
+        # Booting another scsynth would fail to bind the port of the running one
+        if not attach:
+            raise RuntimeError('SuperCollider server is already running at {ip}:{port}, stop it or attach to it.'
+                               .format(ip=server.ip_address, port=server.port))
+
+        logger.debug('Attaching to running SuperCollider server...')
+        attach_server(server)
+        logger.info('Attached to running SuperCollider server: {}'.format(server))
+        return
+
+    logger.debug('Starting SuperCollider server...')
+    server_options = supriya.servertools.ServerOptions()
     server.boot(server_options=server_options)
     logger.info('SuperCollider server started: {}'.format(server))
 
@@ -23,7 +130,7 @@ def stop_audio(*args, **kwargs):
     supriya.servertools.Server.get_default_server().quit()
 
 
-def get_tone_synthdef(amplitude=1., frequency=440., gate=1.):
+def build_tone_synthdef(amplitude=1., frequency=440., gate=1.):
     builder = supriya.synthdeftools.SynthDefBuilder(
         amplitude=amplitude,
         frequency=frequency,
@@ -46,13 +153,58 @@ def get_tone_synthdef(amplitude=1., frequency=440., gate=1.):
             source=source,
         )
 
+    return builder.build()
+
+
+def get_tone_synthdef():
+    """Returns tone synthdef parametrized by frequency. Synthdef is sent to the server only once."""
+    global _tone_synthdef
+    if _tone_synthdef is None:
+        _tone_synthdef = build_tone_synthdef().allocate()
+    return _tone_synthdef
+
+
+def get_bank_synthdef(frequencies, amplitude_bus=0, gate=1.):
+    """Creates synthdef which mixes oscillators of given frequencies with amplitudes read from control buses."""
+    builder = supriya.synthdeftools.SynthDefBuilder(
+        amplitude_bus=amplitude_bus,
+        gate=gate,
+    )
+
+    with builder:
+        amplitudes = supriya.ugentools.In.kr(
+            bus=builder['amplitude_bus'],
+            channel_count=len(frequencies),
+        )
+        if len(frequencies) == 1:
+            amplitudes = [amplitudes]
+        oscillators = [
+            supriya.ugentools.FSinOsc.ar(frequency=frequency) * amplitudes[i]
+            for i, frequency in enumerate(frequencies)
+        ]
+        source = supriya.ugentools.Mix.new(oscillators)
+        envelope = supriya.ugentools.EnvGen.kr(
+            done_action=supriya.synthdeftools.DoneAction.FREE_SYNTH,
+            envelope=supriya.synthdeftools.Envelope.asr(),
+            gate=builder['gate'],
+        )
+        source = source * envelope
+        out = supriya.ugentools.Out.ar(
+            bus=(0, 1),
+            source=source,
+        )
+
     return builder.build().allocate()
 
 
 class SCTone:
-    def __init__(self, frequency, amplitude=1., gate=1., group=None):
+    def __init__(self, frequency, amplitude=1., gate=1., group=None, server=None):
         self._started = False
         self.frequency = frequency
+        self.amplitude = amplitude
+        self.gate = gate
+        self.server = server or supriya.servertools.Server.get_default_server()
+        self.node_id = None
 
         # Allocate group if not specified
         if group is None:
@@ -60,34 +212,63 @@ class SCTone:
             logger.debug('Create dedicated SuperCollider tone group: {}'.format(group))
         self.group = group
 
-        synthdef = get_tone_synthdef(amplitude=amplitude, frequency=frequency, gate=gate)
-        self.synth = supriya.servertools.Synth(synthdef)
+        self.synthdef = get_tone_synthdef()
+
+    def get_new_message(self):
+        """Allocates node ID and returns `s_new` message which creates tone node at the tail of the group."""
+        self.node_id = self.server.node_id_allocator.allocate_node_id()
+        self._started = True
+
+        return supriya.osctools.OscMessage(
+            '/s_new', self.synthdef.actual_name, self.node_id, ADD_TO_TAIL, self.group.node_id,
+            'frequency', self.frequency, 'amplitude', self.amplitude, 'gate', self.gate,
+        )
+
+    def get_release_message(self):
+        """Returns message which releases tone node (it is freed by envelope done action)."""
+        message = supriya.osctools.OscMessage('/n_set', self.node_id, 'gate', 0)
+        self.node_id = None
+        self._started = False
+
+        return message
 
     def play(self, *args, **kwargs):
         if not self._started:
-            self.group.append(self.synth)
-            self._started = True
+            self.server.send_message(self.get_new_message())
             logger.debug('Pushed tone synth for {frequency} Hz to SuperColider server'
                          .format(frequency=self.frequency))
 
     def stop(self):
         if self._started:
-            self.synth.release()
-            self._started = False
+            self.server.send_message(self.get_release_message())
             logger.debug('Released tone synth for {frequency} Hz from SuperColider server'
                          .format(frequency=self.frequency))
 
+    @property
+    def started(self):
+        return self._started
+
     def get_volume(self):
-        return self.synth['amplitude']
+        return self.amplitude
 
     def set_volume(self, volume):
-        self.synth['amplitude'] = volume
+        self.amplitude = volume
+        if self._started:
+            self.server.send_message(supriya.osctools.OscMessage('/n_set', self.node_id, 'amplitude', volume))
         logger.debug('Set {frequency} Hz tone volume to {volume}'.format(frequency=self.frequency, volume=volume))
 
 
 class SCSynth(Synth):
+    """
+    SuperCollider synth with a node per tone.
+
+    Tone nodes created by `play()` start simultaneously a bit later, so messages to them are scheduled not earlier
+    than nodes exist.
+    """
     def __init__(self, base=440, octaves=3, levels=16, shift=-12, server=None):
         self.server = server or supriya.servertools.Server.get_default_server()
+        # Time tone nodes created by the last `play()` appear on the server
+        self.created_at = 0.
 
         # Create group
         self.group = supriya.servertools.Group().allocate()
@@ -99,7 +280,38 @@ class SCSynth(Synth):
 
     def get_tone(self, frequency):
         logger.debug('Create Tone synth for {} Hz'.format(frequency))
-        return SCTone(frequency=frequency, group=self.group)
+        return SCTone(frequency=frequency, group=self.group, server=self.server)
+
+    def play(self, tone=None):
+        if tone is not None:
+            return super().play(tone)
+
+        # Create all tone nodes in timestamped bundles, so they start simultaneously
+        messages = [t.get_new_message() for t in self.tones if not t.started]
+        self.created_at = time.time() + BUNDLE_LATENCY
+        self.send_bundles(messages, self.created_at)
+        logger.info('All tones are ready and playing.')
+
+    def stop(self, tone=None):
+        if tone is not None:
+            messages = [self.tones[tone].get_release_message()] if self.tones[tone].started else []
+        else:
+            messages = [t.get_release_message() for t in self.tones if t.started]
+
+        self.send_bundles(messages, self.get_timestamp())
+        logger.debug('Released {n} tone synths from SuperColider server'.format(n=len(messages)))
+
+    def silence(self):
+        self.set_volumes(np.zeros(len(self.tones), dtype=np.float32))
+
+    def get_timestamp(self, timestamp=None):
+        """Returns time to send messages to tone nodes at, which is delayed until nodes are created."""
+        if self.created_at > (time.time() if timestamp is None else timestamp):
+            return self.created_at
+        return timestamp
+
+    def send_bundles(self, messages, timestamp=None):
+        return send_bundles(self.server, messages, timestamp)
 
     def scale_factor(self):
         return 1 / len(self.tones) ** .5
@@ -108,7 +320,210 @@ class SCSynth(Synth):
         self.server.sync()
 
     def __setitem__(self, key, value):
-        self.tones[key].set_volume(value * self.scale_factor())
+        self.set_volumes([value], [key])
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        """Sends tone volumes to the server in bundles of `n_set` messages, all timetagged with `timestamp` if given."""
+        tones = self.tones if keys is None else [self.tones[key] for key in np.asarray(keys).tolist()]
+        volumes = (np.asarray(volumes, dtype=np.float32) * self.scale_factor()).tolist()
+
+        messages = []
+        for tone, volume in zip(tones, volumes):
+            tone.amplitude = volume
+            if tone.started:
+                messages.append(supriya.osctools.OscMessage('/n_set', tone.node_id, 'amplitude', volume))
+
+        bundles = self.send_bundles(messages, self.get_timestamp(timestamp))
+
+        logger.debug('Set volumes of {n} tones in {bundles} bundles'.format(n=len(messages), bundles=bundles))
+
+
+class SCToneBank:
+    """
+    Oscillator bank which reads all tone amplitudes from a contiguous block of control buses.
+
+    Tones are split between a few synths of `BANK_SIZE` oscillators each. Amplitudes of all tones are pushed with
+    `c_setn` messages of contiguous bus ranges, while a subset of tones is updated with `c_set` messages. Messages
+    carry up to `MAX_BUS_VALUES` values each and are sent in size-bounded bundles.
+    """
+    def __init__(self, frequencies, server, group=None):
+        self.frequencies = frequencies
+        self.server = server
+        self._started = False
+
+        if group is None:
+            group = supriya.servertools.Group().allocate()
+            logger.debug('Create dedicated SuperCollider tone bank group: {}'.format(group))
+        self.group = group
+
+        self.amplitudes = np.zeros(len(frequencies), dtype=np.float32)
+        self.on = np.zeros(len(frequencies), dtype=np.bool_)
+
+        self.bus_group = supriya.servertools.BusGroup(
+            bus_count=len(frequencies),
+            calculation_rate=supriya.synthdeftools.CalculationRate.CONTROL,
+        ).allocate()
+
+        self.synths = []
+        for start in range(0, len(frequencies), BANK_SIZE):
+            synthdef = get_bank_synthdef(frequencies[start:start + BANK_SIZE])
+            self.synths.append(supriya.servertools.Synth(synthdef, amplitude_bus=self.bus_group.bus_id + start))
+        logger.debug('Create {n} tone bank synths for {levels} tones'.format(n=len(self.synths), levels=len(self)))
+
+    def _start(self):
+        if not self._started:
+            for synth in self.synths:
+                self.group.append(synth)
+            self._started = True
+            logger.debug('Pushed {n} tone bank synths to SuperColider server'.format(n=len(self.synths)))
+
+    def play(self):
+        self.on[:] = True
+        self.push()
+        self._start()
+
+    def stop(self):
+        if self._started:
+            for synth in self.synths:
+                synth.release()
+            self._started = False
+            logger.debug('Released tone bank synths from SuperColider server')
+
+    def get_bus_values(self, keys=None):
+        if keys is None:
+            return (self.amplitudes * self.on).tolist()
+        return (self.amplitudes[keys] * self.on[keys]).tolist()
+
+    def push(self, keys=None, timestamp=None):
+        """
+        Sends amplitudes of all tones (or only tones with the given indexes) to control buses.
+
+        If `timestamp` is given messages are wrapped into bundles scheduled for this time.
+        """
+        messages = []
+        if keys is None:
+            values = self.get_bus_values()
+            for start in range(0, len(values), MAX_BUS_VALUES):
+                chunk = values[start:start + MAX_BUS_VALUES]
+                messages.append(supriya.osctools.OscMessage(
+                    '/c_setn', self.bus_group.bus_id + start, len(chunk), *chunk))
+        else:
+            bus_ids = (np.asarray(keys) + self.bus_group.bus_id).tolist()
+            pairs = list(zip(bus_ids, self.get_bus_values(keys)))
+            for start in range(0, len(pairs), MAX_BUS_VALUES // 2):
+                messages.append(supriya.osctools.OscMessage(
+                    '/c_set', *[x for pair in pairs[start:start + MAX_BUS_VALUES // 2] for x in pair]))
+
+        if timestamp is None and len(messages) == 1:
+            self.server.send_message(messages[0])
+        else:
+            send_bundles(self.server, messages, timestamp)
+
+    def set_amplitudes(self, values, keys=None, timestamp=None):
+        if keys is None:
+            self.amplitudes[:] = values
+        else:
+            keys = np.asarray(keys)
+            self.amplitudes[keys] = values
+
+        # Rewriting the whole block is cheaper than sending bus indexes for the most of the tones
+        if keys is not None and 2 * len(keys) < len(self):
+            self.push(keys, timestamp=timestamp)
+        else:
+            self.push(timestamp=timestamp)
+
+    def play_tone(self, key):
+        self.on[key] = True
+        self.push([key])
+        self._start()
+
+    def stop_tone(self, key):
+        self.on[key] = False
+        self.push([key])
+
+    def __getitem__(self, item):
+        return SCBankTone(self, item)
+
+    def __len__(self):
+        return len(self.frequencies)
+
+
+class SCBankTone:
+    """Tone view to a single oscillator of SCToneBank."""
+    def __init__(self, bank, key):
+        self.bank = bank
+        self.key = key
+        self.frequency = bank.frequencies[key]
+
+    def play(self, *args, **kwargs):
+        self.bank.play_tone(self.key)
+
+    def stop(self):
+        self.bank.stop_tone(self.key)
+
+    def get_volume(self):
+        return float(self.bank.amplitudes[self.key])
+
+    def set_volume(self, volume):
+        self.bank.set_amplitudes([volume], [self.key])
+
+    def __repr__(self):
+        return '{cls}({frequency} Hz)'.format(cls=self.__class__.__name__, frequency=self.frequency)
+
+
+class SCBankSynth(Synth):
+    """
+    SuperCollider synth which keeps all tones in a few oscillator bank synths and controls them through buses.
+
+    Per-frame control cost is a single OSC message for up to `MAX_BUS_VALUES` tones.
+    """
+    def __init__(self, base=440, octaves=3, levels=16, shift=-12, server=None):
+        self.server = server or supriya.servertools.Server.get_default_server()
+
+        self.levels = levels
+        self.frequencies = get_frequencies(base, octaves, self.levels, shift)
+
+        self.group = supriya.servertools.Group().allocate()
+        logger.debug('Create SCBankSynth-level SuperCollider tone group: {}'.format(self.group))
+
+        self.tones = SCToneBank(self.frequencies, server=self.server, group=self.group)
+        self.server.sync()
+        logger.info('All tones initialized.')
+
+    def play(self, key=None):
+        if key is not None:
+            self.tones.play_tone(key)
+            logger.debug('Start to play {} tone.'.format(self.tones[key]))
+        else:
+            self.tones.play()
+            logger.info('All tones are ready and playing.')
+
+    def stop(self, key=None):
+        if key is not None:
+            self.tones.stop_tone(key)
+            logger.debug('Stop to play {} tone.'.format(self.tones[key]))
+        else:
+            self.tones.stop()
+            logger.info('All tones stopped.')
+
+    def silence(self):
+        self.tones.set_amplitudes(0)
+
+    def scale_factor(self):
+        return 1 / len(self.tones) ** .5
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        self.tones.set_amplitudes(np.asarray(volumes, dtype=np.float32) * self.scale_factor(), keys,
+                                  timestamp=timestamp)
+
+    def __getitem__(self, item):
+        return self.tones[item].get_volume() / self.scale_factor()
+
+    def __setitem__(self, key, value):
+        self.set_volumes([value], [key])
+
+    def __len__(self):
+        return len(self.tones)
 
 
 def test():
@@ -116,5 +531,10 @@ def test():
     test_run(init_audio, SCSynth)
 
 
+def bank_test():
+    from acoustic_sight.sound_drivers.test_run import test_run
+    test_run(init_audio, SCBankSynth)
+
+
 if __name__ == "__main__":
     test()
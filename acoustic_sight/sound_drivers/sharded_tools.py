@@ -0,0 +1,232 @@
+import multiprocessing
+
+import numpy as np
+import pyaudio
+
+from acoustic_sight.sound_drivers import pa_tools
+from acoustic_sight.sound_drivers.offline_tools import OfflineTone, OfflineToneBank
+from acoustic_sight.synth import Synth, get_frequencies
+from acoustic_sight.tools import get_logger
+
+
+logger = get_logger('sharded_tools')
+
+
+init_audio = pa_tools.init_audio
+stop_audio = pa_tools.stop_audio
+
+
+# Control fields shared with shard workers
+RUNNING = 0
+POSITION = 1
+SLOT = 2
+
+
+def run_shard(shard, frequencies, sample_rate, block_size, control, amplitudes, on, partials, request, done):
+    """Renders raw mix of a shard of tones into shared partial buffers on every request."""
+    bank = OfflineToneBank(frequencies, sample_rate, block_size=block_size, normalize=False)
+
+    control = np.frombuffer(control, dtype=np.int64)
+    partials = np.frombuffer(partials, dtype=np.float32).reshape((2, -1, block_size))
+
+    try:
+        while True:
+            request.wait()
+            request.clear()
+            if not control[RUNNING]:
+                break
+
+            # Amplitude updates may land in the middle of copying, which only delays a part of them by one block
+            bank.amplitudes[:] = np.frombuffer(amplitudes, dtype=np.float32)[shard.start:shard.stop]
+            bank.on[:] = np.frombuffer(on, dtype=np.int8)[shard.start:shard.stop]
+            bank.seek(int(control[POSITION]))
+            partials[control[SLOT], shard.index] = bank.render(block_size)
+
+            done.release()
+    except KeyboardInterrupt:
+        pass
+
+
+class Shard:
+    def __init__(self, index, start, stop):
+        self.index = index
+        self.start = start
+        self.stop = stop
+
+
+class PAShardedToneBank:
+    """
+    Tone bank partitioned across worker processes.
+
+    Every worker renders a raw mix of its tones for the next block into shared memory, while the audio callback sums
+    partial mixes of the current block, normalizes them and hands them to PyAudio. Rendering is pipelined one block
+    ahead, so the callback only waits if workers fall behind.
+    """
+    def __init__(self, frequencies, block_size=1024, shards=None, volume=1.):
+        self.frequencies = np.array(frequencies, dtype=np.float64)
+        self.block_size = block_size
+        self.sample_rate = pa_tools._pa_state.bitrate
+        self.block_duration = block_size / self.sample_rate
+
+        if shards is None:
+            shards = max(1, multiprocessing.cpu_count() - 1)
+        shards = min(shards, len(frequencies))
+        bounds = np.linspace(0, len(frequencies), shards + 1).astype(np.int64).tolist()
+        self.shards = [Shard(i, bounds[i], bounds[i + 1]) for i in range(shards)]
+
+        self._control = multiprocessing.RawArray('q', 3)
+        self._amplitudes = multiprocessing.RawArray('f', len(frequencies))
+        self._on = multiprocessing.RawArray('b', len(frequencies))
+        self._partials = multiprocessing.RawArray('f', 2 * shards * block_size)
+        self.control = np.frombuffer(self._control, dtype=np.int64)
+        self.amplitudes = np.frombuffer(self._amplitudes, dtype=np.float32)
+        self.on = np.frombuffer(self._on, dtype=np.int8)
+        self.partials = np.frombuffer(self._partials, dtype=np.float32).reshape((2, shards, block_size))
+        self.amplitudes[:] = volume
+
+        self.requests = [multiprocessing.Event() for _ in self.shards]
+        self.done = multiprocessing.Semaphore(0)
+        # Number of shards which haven't finished requested block yet
+        self.pending = 0
+
+        self.mixed = np.zeros(block_size, dtype=np.float32)
+
+        self.control[RUNNING] = 1
+        self.workers = [
+            multiprocessing.Process(
+                target=run_shard,
+                args=(shard, self.frequencies[shard.start:shard.stop], self.sample_rate, block_size,
+                      self._control, self._amplitudes, self._on, self._partials, request, self.done),
+                daemon=True,
+            )
+            for shard, request in zip(self.shards, self.requests)
+        ]
+        for worker in self.workers:
+            worker.start()
+        logger.info('Started {n} synthesis shards for {levels} tones.'.format(n=len(self.workers), levels=len(self)))
+
+        self._request_block()
+        self.stream = self._get_stream()
+
+    def _request_block(self):
+        for request in self.requests:
+            request.set()
+        self.pending = len(self.shards)
+
+    def _get_stream(self):
+        def stream_callback(in_data, frame_count, time_info, status):
+            return self._get_samples(frame_count), pyaudio.paContinue
+
+        return pa_tools._pa_state.pa_instance.open(
+            format=pyaudio.paFloat32,
+            channels=pa_tools._pa_state.channels,
+            rate=self.sample_rate,
+            output=True,
+            frames_per_buffer=self.block_size,
+            stream_callback=stream_callback,
+        )
+
+    def _get_samples(self, frame_count):
+        while self.pending and self.done.acquire(timeout=self.block_duration):
+            self.pending -= 1
+
+        if self.pending:
+            # Workers are behind, skip the block
+            logger.debug('Synthesis underrun, {n} shards pending.'.format(n=self.pending))
+            return np.zeros(frame_count, dtype=np.float32)
+
+        slot = int(self.control[SLOT])
+        np.sum(self.partials[slot], axis=0, out=self.mixed)
+        amplitudes = self.amplitudes * self.on
+        self.mixed *= 1 / (np.abs(amplitudes).sum() + 1) ** .5
+        np.clip(self.mixed, -1, 1, out=self.mixed)
+
+        # Render the next block while this one plays
+        self.control[SLOT] = 1 - slot
+        self.control[POSITION] += self.block_size
+        self._request_block()
+
+        return self.mixed[:frame_count]
+
+    def play(self):
+        self.on[:] = 1
+        self.stream.start_stream()
+
+    def stop(self):
+        self.stream.stop_stream()
+
+    def close(self):
+        self.control[RUNNING] = 0
+        for request in self.requests:
+            request.set()
+        for worker in self.workers:
+            worker.join()
+        self.stream.close()
+
+    def set_amplitudes(self, values, keys=None):
+        if keys is None:
+            self.amplitudes[:] = values
+        else:
+            self.amplitudes[np.asarray(keys)] = values
+
+    def play_tone(self, key):
+        self.on[key] = 1
+
+    def stop_tone(self, key):
+        self.on[key] = 0
+
+    def __getitem__(self, item):
+        return OfflineTone(self, item)
+
+    def __len__(self):
+        return len(self.frequencies)
+
+
+class PAShardedSynth(Synth):
+    """PyAudio synth which splits tone synthesis between worker processes, one per spare CPU core by default."""
+    def __init__(self, base=440, octaves=3, levels=16, shift=-12, block_size=1024, shards=None):
+        self.levels = levels
+        self.frequencies = get_frequencies(base, octaves, self.levels, shift)
+
+        self.tones = PAShardedToneBank(self.frequencies, block_size=block_size, shards=shards)
+        logger.info('All tones initialized.')
+
+    def play(self, key=None):
+        if key is not None:
+            self.tones.play_tone(key)
+            logger.debug('Start to play {} tone.'.format(self.tones[key]))
+        else:
+            self.tones.play()
+            logger.info('All tones are ready and playing.')
+
+    def stop(self, key=None):
+        if key is not None:
+            self.tones.stop_tone(key)
+            logger.debug('Stop to play {} tone.'.format(self.tones[key]))
+        else:
+            self.tones.stop()
+            logger.info('All tones stopped.')
+
+    def silence(self):
+        self.tones.set_amplitudes(0)
+
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        self.tones.set_amplitudes(volumes, keys)
+
+    def __getitem__(self, item):
+        return self.tones[item].get_volume()
+
+    def __setitem__(self, key, value):
+        self.tones.set_amplitudes([value], [key])
+
+    def __len__(self):
+        return len(self.tones)
+
+    def __del__(self):
+        self.stop()
+        self.tones.close()
+
+
+def test():
+    from acoustic_sight.sound_drivers.test_run import test_run
+    test_run(init_audio, PAShardedSynth)
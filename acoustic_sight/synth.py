@@ -1,3 +1,5 @@
+import numpy as np
+
 from acoustic_sight.tools import get_logger
 
 
@@ -57,6 +59,27 @@ class Synth:
     def sync(self):
         pass
 
+    def set_volumes(self, volumes, keys=None, timestamp=None):
+        """
+        Sets volumes of many tones at once from a sequence (or NumPy array).
+
+        If `keys` are not specified `volumes` should contain `len(self)` values, one per tone. Otherwise volumes are
+        set only for tones with the given indexes.
+
+        If `timestamp` (wall-clock time in seconds, as returned by `time.time()`) is given drivers which support
+        scheduling apply volumes when it is played, others apply them immediately.
+        """
+        if keys is None:
+            keys = range(len(self))
+        else:
+            keys = np.asarray(keys).tolist()
+
+        if len(volumes) != len(keys):
+            raise ValueError('Expected {n} volumes, {given} given.'.format(n=len(keys), given=len(volumes)))
+
+        for key, volume in zip(keys, np.asarray(volumes).tolist()):
+            self[key] = volume
+
     def __getitem__(self, item):
         return self.tones[item].get_volume()
 
@@ -2,12 +2,15 @@ import logging
 import os
 import time
 
+import numpy as np
+
 
 ACOUSTIC_SIGHT_DIR = os.path.dirname(os.path.realpath(__file__))
 PROJECT_DIR = os.path.dirname(ACOUSTIC_SIGHT_DIR)
 ACOUSTIC_SIGHT_SERVER_DIR = os.path.join(PROJECT_DIR, 'acoustic_sight_server')
 SERVICES_DIR = os.path.join(PROJECT_DIR, 'services')
 DATA_DIR = os.path.join(SERVICES_DIR, 'data')
+CACHE_DIR = os.path.join(SERVICES_DIR, 'cache')
 
 
 def get_logger(name, level=logging.INFO):
@@ -17,6 +20,28 @@ def get_logger(name, level=logging.INFO):
     return logger
 
 
+def save_array(arr, path):
+    """Atomically saves array to `.npy` file and returns it memory-mapped in read-only mode."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp_path, path)
+
+    return np.load(path, mmap_mode='r')
+
+
+def load_array(path):
+    """Returns array memory-mapped from `.npy` file in read-only mode or None if it can't be loaded."""
+    if not os.path.exists(path):
+        return None
+
+    try:
+        return np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+
 class TimeMeasurer(object):
     def __init__(self, logger=None, level=logging.DEBUG):
         self.logger = logger
@@ -0,0 +1,85 @@
+"""
+Pixel intensity to tone amplitude curves.
+
+Each curve is precomputed into a 256-entry lookup table, so the whole uint8 frame is converted into amplitudes by a
+single indexing operation.
+"""
+import numpy as np
+
+
+LINEAR = 'linear'
+THRESHOLD = 'threshold'
+EXP = 'exp'
+
+_curves = dict()
+_tables = dict()
+
+
+def register_volume_curve(name, curve):
+    """
+    Registers volume curve under the given name.
+
+    Curve accepts array of intensities in [0, 1] and `max_volume`, and returns array of amplitudes of the same shape.
+    """
+    _curves[name] = curve
+
+
+def get_volume_curve_names():
+    return tuple(_curves.keys())
+
+
+def build_volume_table(curve, max_volume=1., quantization=None):
+    """
+    Precomputes uint8 -> float32 lookup table for volume curve.
+
+    If `quantization` is specified amplitudes are rounded to this number of equal steps between zero and the
+    table maximum.
+    """
+    intensities = np.arange(256, dtype=np.float64) / 255
+    table = np.asarray(curve(intensities, max_volume), dtype=np.float64).reshape((256,))
+
+    if quantization:
+        top = np.abs(table).max()
+        if top > 0:
+            step = top / quantization
+            table = np.round(table / step) * step
+
+    table = table.astype(np.float32)
+    table.setflags(write=False)
+
+    return table
+
+
+def get_volume_table(volume_type=LINEAR, max_volume=1., quantization=None):
+    """
+    Returns cached lookup table for a registered volume curve name. Callables are treated as user-defined curves.
+    """
+    if callable(volume_type):
+        return build_volume_table(volume_type, max_volume, quantization)
+
+    if volume_type not in _curves:
+        raise ValueError('Volume type is not supported: {volume_type}. Available types: {names}.'.format(
+            volume_type=volume_type, names=', '.join(get_volume_curve_names())))
+
+    key = (volume_type, max_volume, quantization)
+    if key not in _tables:
+        _tables[key] = build_volume_table(_curves[volume_type], max_volume, quantization)
+
+    return _tables[key]
+
+
+def linear_curve(intensities, max_volume=1.):
+    return intensities * max_volume
+
+
+def threshold_curve(intensities, max_volume=1.):
+    return (intensities > 127 / 255) * 1.
+
+
+def exp_curve(intensities, max_volume=1.):
+    return (np.exp(intensities) - 1) / (np.exp(1) - 1) * max_volume
+
+
+register_volume_curve(LINEAR, linear_curve)
+register_volume_curve(THRESHOLD, threshold_curve)
+register_volume_curve(EXP, exp_curve)
@@ -0,0 +1,123 @@
+"""
+Downsampling of processed frames to the tone grid.
+
+Geometry of the fixed input to grid mapping is precomputed once: every grid cell covers a block of input rows and
+columns (block boundaries are spread evenly, so blocks differ by at most one pixel). Frames are then reduced with
+integer arithmetic in their own dtype (uint8 or uint16) into preallocated buffers:
+
+* `MEAN` averages blocks (area downsampling) with integer sums and rounding division,
+* `MAX` max-pools blocks, so thin features like one pixel Canny edges survive,
+* `PERCENTILE` takes the given percentile (nearest rank) of equally sized blocks of the central region.
+"""
+import numpy as np
+
+
+MEAN = 'mean'
+MAX = 'max'
+PERCENTILE = 'percentile'
+
+METHODS = (MEAN, MAX, PERCENTILE)
+
+
+def get_block_starts(size_in, size_out):
+    """Returns first input index of each of `size_out` blocks covering `size_in` pixels."""
+    if size_in < size_out:
+        raise ValueError('Unable to downsample {size_in} pixels to {size_out}.'.format(
+            size_in=size_in, size_out=size_out))
+
+    return np.arange(size_out) * size_in // size_out
+
+
+def get_accumulator_dtype(dtype):
+    if dtype == np.uint8:
+        return np.uint32
+    elif dtype.kind in 'ui':
+        return np.uint64
+    else:
+        return np.float64
+
+
+class Downsampler(object):
+    def __init__(self, shape, method=MEAN, percentile=90):
+        if method not in METHODS:
+            raise ValueError('Downsampling method is not supported: {method}.'.format(method=method))
+
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.method = method
+        self.percentile = float(percentile)
+
+        self.image_shape = None
+        self.dtype = None
+
+        self.row_starts = None
+        self.column_starts = None
+        self.counts = None
+        self.half_counts = None
+        self.rows = None
+        self.sums = None
+
+        self.crop = None
+        self.blocks = None
+        self.rank = None
+
+        self.result = None
+
+    def prepare(self, image_shape, dtype):
+        """Precomputes block geometry and allocates buffers for the given image shape and dtype."""
+        height, width = image_shape[:2]
+        dtype = np.dtype(dtype)
+        self.row_starts = get_block_starts(height, self.shape[0])
+        self.column_starts = get_block_starts(width, self.shape[1])
+        self.result = np.empty(self.shape, dtype=dtype)
+
+        if self.method == MEAN:
+            accumulator = get_accumulator_dtype(dtype)
+            row_counts = np.diff(np.append(self.row_starts, height))
+            column_counts = np.diff(np.append(self.column_starts, width))
+            self.counts = np.outer(row_counts, column_counts).astype(accumulator)
+            self.half_counts = self.counts // 2 if accumulator != np.float64 else np.zeros_like(self.counts)
+            self.rows = np.empty((self.shape[0], width), dtype=accumulator)
+            self.sums = np.empty(self.shape, dtype=accumulator)
+        elif self.method == MAX:
+            self.rows = np.empty((self.shape[0], width), dtype=dtype)
+        elif self.method == PERCENTILE:
+            # Equally sized blocks, so cells are rows of a single array which is partitioned in place
+            block_height, block_width = height // self.shape[0], width // self.shape[1]
+            top = (height - block_height * self.shape[0]) // 2
+            left = (width - block_width * self.shape[1]) // 2
+            self.crop = (slice(top, top + block_height * self.shape[0]),
+                         slice(left, left + block_width * self.shape[1]))
+            self.blocks = np.empty((self.shape[0], self.shape[1], block_height, block_width), dtype=dtype)
+            self.rank = int(round(self.percentile / 100 * (block_height * block_width - 1)))
+
+        self.image_shape = (height, width)
+        self.dtype = dtype
+
+    def downsample(self, image):
+        if image.shape[:2] != self.image_shape or image.dtype != self.dtype:
+            self.prepare(image.shape, image.dtype)
+
+        if self.method == MEAN:
+            np.add.reduceat(image, self.row_starts, axis=0, dtype=self.rows.dtype, out=self.rows)
+            np.add.reduceat(self.rows, self.column_starts, axis=1, out=self.sums)
+            self.sums += self.half_counts
+            if self.sums.dtype.kind == 'f':
+                np.true_divide(self.sums, self.counts, out=self.sums)
+            else:
+                np.floor_divide(self.sums, self.counts, out=self.sums)
+            self.result[...] = self.sums
+        elif self.method == MAX:
+            np.maximum.reduceat(image, self.row_starts, axis=0, out=self.rows)
+            np.maximum.reduceat(self.rows, self.column_starts, axis=1, out=self.result)
+        elif self.method == PERCENTILE:
+            height, width, block_height, block_width = self.blocks.shape
+            region = image[self.crop].reshape((height, block_height, width, block_width))
+            self.blocks[...] = region.transpose((0, 2, 1, 3))
+            cells = self.blocks.reshape((height, width, block_height * block_width))
+            cells.partition(self.rank, axis=2)
+            self.result[...] = cells[..., self.rank]
+
+        return self.result
+
+    def __call__(self, image):
+        return self.downsample(image)
@@ -0,0 +1,108 @@
+"""
+Foveated multi-resolution sampling.
+
+Frame is sampled on a coarse `(height, width)` grid in the periphery and on a `fovea_scale` times finer grid in the
+central region, which covers `fovea_fraction` of the frame side. All cells are ordered into a single tone vector along
+the space-filling curve of the fine grid, so neighbouring cells get neighbouring tones in both regions.
+
+Sampling geometry is precomputed into a permutation which groups image pixels by tones, so each frame is sampled by a
+single gather and a single integer sum over tone segments, and the result keeps the image dtype.
+"""
+import numpy as np
+
+from acoustic_sight import mappings
+from acoustic_sight_server.downsampling import get_accumulator_dtype
+
+
+class FoveatedSampler(object):
+    def __init__(self, shape, fovea_scale=2, fovea_fraction=.5, mapping=mappings.HILBERT):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.fovea_scale = int(fovea_scale)
+        self.fovea_fraction = float(fovea_fraction)
+
+        height, width = self.shape
+        scale = self.fovea_scale
+        self.fine_shape = (height * scale, width * scale)
+
+        # Fovea is aligned to coarse cells, so each peripheral cell is either entirely inside or outside of it
+        fovea_height = int(round(height * self.fovea_fraction))
+        fovea_width = int(round(width * self.fovea_fraction))
+        top = (height - fovea_height) // 2
+        left = (width - fovea_width) // 2
+
+        ys, xs = np.indices(self.fine_shape)
+        coarse_ys, coarse_xs = ys // scale, xs // scale
+        in_fovea = ((coarse_ys >= top) & (coarse_ys < top + fovea_height) &
+                    (coarse_xs >= left) & (coarse_xs < left + fovea_width))
+        cells = np.where(in_fovea, height * width + ys * self.fine_shape[1] + xs, coarse_ys * width + coarse_xs)
+
+        # Order cells by the first position of their fine cells along the curve
+        ranks = mappings.get_mapping_index(mapping, self.fine_shape)
+        ids, inverse = np.unique(cells.ravel(), return_inverse=True)
+        first_ranks = np.full(len(ids), ranks.size, dtype=np.int64)
+        np.minimum.at(first_ranks, inverse, ranks)
+        order = np.argsort(first_ranks)
+        tones = np.empty_like(order)
+        tones[order] = np.arange(len(order))
+
+        self.size = len(ids)
+        self.fine_tones = tones[inverse].reshape(self.fine_shape)
+
+        self.image_shape = None
+        self.dtype = None
+        self.order = None
+        self.starts = None
+        self.present = None
+        self.counts = None
+        self.half_counts = None
+        self.pixels = None
+        self.sums = None
+        self.result = None
+
+    def prepare(self, image_shape, dtype=np.uint8):
+        """Precomputes pixel order and tone segments, and allocates buffers for the given image shape and dtype."""
+        height, width = image_shape[:2]
+        dtype = np.dtype(dtype)
+        rows = np.arange(height) * self.fine_shape[0] // height
+        columns = np.arange(width) * self.fine_shape[1] // width
+
+        labels = self.fine_tones[rows[:, None], columns[None, :]].ravel()
+        self.order = np.argsort(labels, kind='mergesort')
+        counts = np.bincount(labels, minlength=self.size)
+
+        # Tones without pixels (images smaller than the fine grid) stay silent
+        self.present = np.flatnonzero(counts)
+        self.starts = (np.cumsum(counts) - counts)[self.present]
+
+        accumulator = get_accumulator_dtype(dtype)
+        self.counts = counts[self.present].astype(accumulator)
+        self.half_counts = self.counts // 2 if accumulator != np.float64 else np.zeros_like(self.counts)
+        self.pixels = np.empty(labels.shape, dtype=dtype)
+        self.sums = np.empty(len(self.present), dtype=accumulator)
+        self.result = np.zeros(self.size, dtype=dtype)
+
+        self.image_shape = (height, width)
+        self.dtype = dtype
+
+    def sample(self, image):
+        """Returns mean values of the image over tone cells in the image dtype."""
+        if image.shape[:2] != self.image_shape or image.dtype != self.dtype:
+            self.prepare(image.shape, image.dtype)
+
+        np.take(image.ravel(), self.order, out=self.pixels)
+        np.add.reduceat(self.pixels, self.starts, dtype=self.sums.dtype, out=self.sums)
+        self.sums += self.half_counts
+        if self.sums.dtype.kind == 'f':
+            np.true_divide(self.sums, self.counts, out=self.sums)
+        else:
+            np.floor_divide(self.sums, self.counts, out=self.sums)
+        self.result[self.present] = self.sums
+
+        return self.result
+
+    def render(self, vec):
+        """Renders tone vector into fine grid image."""
+        return vec[self.fine_tones]
+
+    def __len__(self):
+        return self.size
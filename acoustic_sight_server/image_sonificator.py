@@ -1,23 +1,35 @@
 import logging
 import time
 from http.client import IncompleteRead
+from queue import Empty
 
 import numpy as np
-from skimage.transform import resize
 
-from acoustic_sight import sound_drivers
+from acoustic_sight import mappings, sound_drivers
 from acoustic_sight.sonificator import Sonificator
 from acoustic_sight.tools import DATA_DIR
-from acoustic_sight_server.tools import square_crop
+from acoustic_sight_server.downsampling import Downsampler
+from acoustic_sight_server.foveation import FoveatedSampler
+from acoustic_sight_server.pipeline import LatestSlot, PipelineStage
+from acoustic_sight_server.tools import aspect_crop
 from acoustic_sight_server.rpi_cam_client.image_retriever import get_client, RetrieverTypes
 from acoustic_sight_server.savers.image_saver import PILImageSaver
 from acoustic_sight.tools import TimeMeasurer, get_logger
+from acoustic_sight_server import transformations
 from acoustic_sight_server.transformations.basic import CannyTransformation
 
 
+# Camera frames should be at least this many times larger than the tone grid
+CAPTURE_SCALE = 8
+
+# Passed through the pipeline when recording is over
+END_OF_STREAM = 'end_of_stream'
+
+
 class ImageSonificator(object):
     def __init__(self, remote_host='localhost', remote_port=8000,
-                 frame_rate=24, side_in=2**3,
+                 frame_rate=24, side_in=2**3, width_in=None, height_in=None,
+                 mapping=mappings.HILBERT, fovea_scale=None, fovea_fraction=.5,
                  octaves=6, tone_shift=-18,
                  sonify=True, show_image=False,
                  synth_type=sound_drivers.SUPER_COLLIDER,
@@ -26,8 +38,18 @@ class ImageSonificator(object):
                  log_level=logging.INFO,
                  profile=False,
                  save_images=False,
-                 sigma=2, initial_mul=32, decrease=1.2,
+                 transformation=transformations.CANNY,
+                 sigma=2, initial_mul=32, decrease=1.2, canny_backend=None,
+                 downsampling=None, percentile=90,
+                 pipelined=False,
                  **kwargs):
+        """
+        If `pipelined` is set images are captured and processed in background threads connected by "latest wins"
+        slots, so the frame rate is limited by the slowest stage rather than by the sum of all stages.
+
+        Transformed images are downsampled to the tone grid with `downsampling` method (see
+        `acoustic_sight_server.downsampling`), by default the one preferred by the transformation.
+        """
         if logger is None:
             self.logger = get_logger('ImageSonificator', level=log_level)
         else:
@@ -46,6 +68,15 @@ class ImageSonificator(object):
         self.remote_port = remote_port
         self.frame_rate = frame_rate
         self.side_in = side_in
+        self.width_in = int(width_in or side_in)
+        self.height_in = int(height_in or side_in)
+
+        # Foveated sampling replaces uniform downsampling if fovea scale is set
+        self.foveated_sampler = None
+        if fovea_scale:
+            self.foveated_sampler = FoveatedSampler((self.height_in, self.width_in),
+                                                    fovea_scale=fovea_scale, fovea_fraction=fovea_fraction,
+                                                    mapping=mapping)
 
         self.sonify = sonify
         self.sonificator = None
@@ -55,15 +86,41 @@ class ImageSonificator(object):
 
         self.show_image = show_image
         self.cv2 = None
+        # Images to be shown by the thread which sonifies them, since OpenCV windows should stay on a single thread
+        self.debug_images = {}
 
-        self.rpi_cam_client = get_client(retriever_type)(self.remote_host, self.remote_port, profile=profile)
+        if self.foveated_sampler is not None:
+            grid_height, grid_width = self.foveated_sampler.fine_shape
+        else:
+            grid_height, grid_width = self.height_in, self.width_in
+        self.rpi_cam_client = get_client(retriever_type)(
+            self.remote_host, self.remote_port, profile=profile,
+            min_size=(grid_width * CAPTURE_SCALE, grid_height * CAPTURE_SCALE),
+            aspect=self.width_in / self.height_in,
+        )
 
         self.started = False
 
+        self.pipelined = pipelined
+        self.stages = []
+        self.captured_slot = None
+        self.processed_slot = None
+
+        # Time the last image was captured at and its age when it was retrieved
+        self.capture_time = None
+        self.frame_age = 0.
+
         self.last_time_checkpoint = time.time()
 
         if sonify:
+            if self.foveated_sampler is not None:
+                # Samples are already ordered into tone vectors
+                mapping, shape = mappings.ROW_MAJOR, (1, len(self.foveated_sampler))
+            else:
+                shape = (self.height_in, self.width_in)
+
             self.sonificator = Sonificator(side_in=side_in,
+                                           mapping=mapping, shape=shape,
                                            octaves=octaves, shift=tone_shift,
                                            synth_type=synth_type, profile=profile,
                                            **kwargs,
@@ -75,7 +132,15 @@ class ImageSonificator(object):
             import cv2
             self.cv2 = cv2
 
-        self.transforamtion = CannyTransformation(self, sigma=sigma, initial_mul=initial_mul, decrease=decrease)
+        if transformation == transformations.CANNY:
+            self.transforamtion = CannyTransformation(self, sigma=sigma, initial_mul=initial_mul, decrease=decrease,
+                                                      backend=canny_backend)
+        else:
+            self.transforamtion = transformations.get_transformation(transformation)(self)
+
+        self.downsampler = Downsampler((self.height_in, self.width_in),
+                                       method=downsampling or self.transforamtion.downsampling,
+                                       percentile=percentile)
 
     def process_full_size_image(self, image):
         return self.transforamtion.transform(image)
@@ -87,49 +152,167 @@ class ImageSonificator(object):
         if self.save_images:
             self.image_saver.save(img)
 
-    def get_data(self):
-        img = self.rpi_cam_client.get_image()
-        self.save_image(img)
+    def prepare_image(self, frame):
+        """Crops grayscale frame to the aspect ratio of the tone grid."""
+        return aspect_crop(frame, aspect=self.width_in / self.height_in)
 
-        # Prepare square array:
-        img_arr = np.array(img.convert('L'))
-        cropped = square_crop(img_arr)
+    def downsample(self, image):
+        if self.foveated_sampler is not None:
+            samples = self.foveated_sampler.sample(image)
+            downsampled = samples.reshape((1, len(samples)))
+        else:
+            downsampled = self.downsampler(image)
 
-        full_size_processed = self.process_full_size_image(cropped)
+        if downsampled.dtype == np.uint8:
+            return downsampled
+        elif downsampled.dtype.kind == 'f':
+            # Float images are expected in [0, 1] range
+            return (downsampled * 255).astype(np.uint8)
+        else:
+            return (downsampled >> (8 * (downsampled.itemsize - 1))).astype(np.uint8)
 
-        # Downsample image
-        downsampled = resize(full_size_processed, (self.side_in, self.side_in), mode='reflect')
-        downsampled = (downsampled * 255).astype(np.uint8)
+    def capture(self):
+        """Returns the next frame as grayscale array, PIL images are requested from the client only to be saved."""
+        if self.save_images:
+            img = self.rpi_cam_client.get_image()
+            frame = np.asarray(img.convert('L'))
+        else:
+            img = None
+            frame = self.rpi_cam_client.get_frame()
+        # Clients grabbing frames in background return images captured a while ago
+        self.frame_age = self.rpi_cam_client.last_frame_age
+        self.capture_time = time.time() - self.frame_age
 
-        downsampled_processed = self.process_downsampled_image(downsampled)
+        if img is not None:
+            self.save_image(img)
 
-        return downsampled_processed
+        return frame
+
+    def process_image(self, frame):
+        cropped = self.prepare_image(frame)
+        full_size_processed = self.process_full_size_image(cropped)
+        downsampled = self.downsample(full_size_processed)
+
+        return self.process_downsampled_image(downsampled)
+
+    def get_data(self):
+        return self.process_image(self.capture())
+
+    def display(self, name, image):
+        """Queues debug image to be shown in the named window on the next output."""
+        # Processing buffers are reused for the next frames
+        self.debug_images[name] = np.array(image)
+
+    def output(self, data, timestamp=None):
+        if self.sonify:
+            self.sonificator.sonify(data, timestamp=timestamp)
+
+        if self.show_image:
+            if self.foveated_sampler is not None:
+                data = self.foveated_sampler.render(data[0])
+            for name in list(self.debug_images):
+                self.cv2.imshow(name, self.debug_images.pop(name))
+            self.cv2.imshow('frame', data)
+            if self.cv2.waitKey(1) & 0xFF == ord('q'):
+                self.stop()
 
     def start(self):
         self.rpi_cam_client.start()
         self.sonificator.silence()
         self.started = True
 
-    def next(self):
+        if self.pipelined:
+            self.start_pipeline()
+
+    def _capture_stage(self):
         try:
-            data = self.get_data()
+            # Client may reuse frame buffer while the frame is processed
+            frame = np.array(self.capture())
+        except (OSError, IncompleteRead):
+            # Missing image silences the output
+            return time.time(), None
+        except EOFError:
+            return time.time(), END_OF_STREAM
+
+        return self.capture_time, frame
+
+    def _process_stage(self, item):
+        capture_time, frame = item
+        if frame is None or frame is END_OF_STREAM:
+            return item
+
+        # Downsampler reuses its output buffer while the previous result may still be sonified
+        return capture_time, np.array(self.process_image(frame))
+
+    def start_pipeline(self):
+        """Starts capture and processing threads, while sonification is left for the calling thread."""
+        self.captured_slot = LatestSlot('captured')
+        self.processed_slot = LatestSlot('processed')
+        self.stages = [
+            PipelineStage('capture', self._capture_stage, target=self.captured_slot, period=1 / self.frame_rate),
+            PipelineStage('process', self._process_stage, source=self.captured_slot, target=self.processed_slot),
+        ]
+        for stage in self.stages:
+            stage.start()
+
+    def stop_pipeline(self):
+        for stage in self.stages:
+            stage.stop()
+        if self.processed_slot is not None:
+            self.processed_slot.close()
+
+        self.logger.info('Pipeline stats: {}'.format(self.get_pipeline_stats()))
+        self.stages = []
+
+    def get_pipeline_stats(self):
+        stats = {stage.name: stage.get_stats() for stage in self.stages}
+        for slot in (self.captured_slot, self.processed_slot):
+            if slot is not None:
+                stats[slot.name] = slot.get_stats()
+
+        return stats
+
+    def next_pipelined(self):
+        """Sonifies the latest processed image, waits for it not longer than a frame period."""
+        try:
+            capture_time, data = self.processed_slot.get(timeout=1 / self.frame_rate)
+        except Empty:
+            return self.started
+
+        if data is END_OF_STREAM:
+            self.finish()
+        elif data is None:
+            self.sonificator.silence()
+        else:
+            self.output(data, timestamp=capture_time)
 
-            if self.sonify:
-                self.sonificator.sonify(data)
+        return self.started
 
-            if self.show_image:
-                self.cv2.imshow('frame', data)
-                if self.cv2.waitKey(1) & 0xFF == ord('q'):
-                    self.stop()
+    def next(self):
+        if self.stages:
+            return self.next_pipelined()
 
+        try:
+            data = self.get_data()
+            self.output(data, timestamp=self.capture_time)
         except (OSError, IncompleteRead):
             self.sonificator.silence()
+        except EOFError:
+            self.finish()
 
         return self.started
 
+    def finish(self):
+        """Stops sonification when there are no more images (recording is over)."""
+        self.logger.info('No more images to sonify, stopping.')
+        self.sonificator.silence()
+        self.stop()
+
     def stop(self):
         if self.started:
             self.started = False
+            if self.stages:
+                self.stop_pipeline()
             self.rpi_cam_client.stop()
 
     def get_sleep_timeout(self):
@@ -151,7 +334,9 @@ class ImageSonificator(object):
         try:
             while self.started:
                 self.next()
-                self.await(sleep_fn)
+                # Pipelined capture is paced by its own thread
+                if not self.stages:
+                    self.await(sleep_fn)
         except KeyboardInterrupt:
             pass
 
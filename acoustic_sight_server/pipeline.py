@@ -0,0 +1,138 @@
+"""
+Building blocks of the overlapped capture/process/sonify pipeline.
+
+Stages run in their own threads and pass items through single-slot "latest wins" queues: a new item replaces the one
+the next stage hasn't taken yet, so slow stages always get the freshest frame and never accumulate backlog.
+"""
+import threading
+import time
+from queue import Empty
+
+from acoustic_sight.tools import get_logger
+
+
+logger = get_logger('pipeline')
+
+
+# Stage threads check whether they should exit at least this often (seconds)
+POLL_INTERVAL = .1
+
+
+class LatestSlot:
+    """Single-slot queue where a new item replaces the one not taken yet (drop-oldest policy)."""
+    def __init__(self, name):
+        self.name = name
+        self._item = None
+        self._full = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self.put_count = 0
+        self.dropped = 0
+        self.taken = 0
+
+    def put(self, item):
+        with self._condition:
+            if self._full:
+                self.dropped += 1
+            self._item = item
+            self._full = True
+            self.put_count += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """Takes the latest item, raises `queue.Empty` on timeout or if the slot is closed."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._full or self._closed, timeout):
+                raise Empty
+            if not self._full:
+                raise Empty
+
+            item = self._item
+            self._item = None
+            self._full = False
+            self.taken += 1
+
+            return item
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def get_stats(self):
+        return {'put': self.put_count, 'dropped': self.dropped, 'taken': self.taken}
+
+
+class PipelineStage(threading.Thread):
+    """
+    Thread which applies `fn` to items from `source` slot and puts results to `target` slot.
+
+    Stages without source call `fn` without arguments, optionally not more often than once per `period` seconds.
+    Results which are None are not passed further.
+    """
+    def __init__(self, name, fn, source=None, target=None, period=None):
+        super().__init__(name=name, daemon=True)
+
+        self.fn = fn
+        self.source = source
+        self.target = target
+        self.period = period
+
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.
+        self._running = False
+
+    def _next_args(self):
+        """Returns arguments of the next `fn` call, or None if there is no item to process yet."""
+        if self.source is None:
+            return ()
+
+        try:
+            return (self.source.get(timeout=POLL_INTERVAL),)
+        except Empty:
+            return None
+
+    def start(self):
+        # Set before the thread is scheduled, so a following stop() isn't overwritten
+        self._running = True
+        super().start()
+
+    def run(self):
+        deadline = time.time()
+
+        while self._running:
+            args = self._next_args()
+            if args is None:
+                continue
+
+            # Waiting for items isn't counted as busy time
+            started = time.time()
+            try:
+                result = self.fn(*args)
+            except Exception as e:
+                self.errors += 1
+                logger.exception('{name} stage failed: {error}'.format(name=self.name, error=e))
+                result = None
+            else:
+                self.busy_time += time.time() - started
+
+            if result is not None:
+                self.processed += 1
+                if self.target is not None:
+                    self.target.put(result)
+
+            if self.period is not None:
+                deadline = max(deadline + self.period, time.time() - self.period)
+                time.sleep(max(0., deadline - time.time()))
+
+    def stop(self):
+        self._running = False
+        if self.source is not None:
+            self.source.close()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def get_stats(self):
+        return {'processed': self.processed, 'errors': self.errors, 'busy_time': self.busy_time}
@@ -0,0 +1,184 @@
+"""
+End-to-end pipeline benchmark.
+
+Synthetic (or recorded) frames are fed through ImageSonificator with the null sound driver as fast as possible, while
+each stage of the pipeline is timed separately.
+"""
+import json
+import logging
+import platform
+import time
+
+import numpy as np
+
+from acoustic_sight import sound_drivers
+from acoustic_sight.tools import get_logger
+from acoustic_sight_server import transformations
+from acoustic_sight_server.image_sonificator import ImageSonificator
+from acoustic_sight_server.rpi_cam_client.image_retriever import RetrieverTypes
+
+
+logger = get_logger('pipeline_benchmark')
+
+
+STAGES = ('capture', 'prepare', 'transform', 'downsample', 'sonify', 'total', 'frame_age')
+
+SIDES = (8, 16, 32, 64)
+TRANSFORMATIONS = (transformations.NONE, transformations.CANNY)
+
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    """Records durations of the wrapped methods by stage."""
+    def __init__(self, stages=STAGES):
+        self.durations = {stage: [] for stage in stages}
+
+    def wrap(self, obj, name, stage):
+        fn = getattr(obj, name)
+        durations = self.durations[stage]
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            result = fn(*args, **kwargs)
+            durations.append(time.perf_counter() - started)
+            return result
+
+        setattr(obj, name, timed)
+
+    def record(self, stage, duration):
+        self.durations[stage].append(duration)
+
+    def reset(self):
+        for durations in self.durations.values():
+            del durations[:]
+
+    def get_stats(self):
+        """Returns mean and percentiles of stage durations in milliseconds."""
+        stats = dict()
+        for stage, durations in self.durations.items():
+            if not durations:
+                continue
+            durations = np.asarray(durations) * 1000
+            stats[stage] = {'mean': float(durations.mean())}
+            for q in PERCENTILES:
+                stats[stage]['p{}'.format(q)] = float(np.percentile(durations, q))
+
+        return stats
+
+
+def measure_pipeline(side_in, transformation, frames=120, warmup_frames=10, src=None, image_size='640x480',
+                     pipelined=False, frame_rate=1000, **kwargs):
+    """
+    Runs the pipeline until `frames` frames are sonified (after `warmup_frames`) and returns its measurements.
+
+    Pipelined capture is paced by `frame_rate`, which is high by default to measure sustained throughput.
+    """
+    image_sonificator = ImageSonificator(
+        remote_host=src or image_size, remote_port=None,
+        side_in=side_in, frame_rate=frame_rate, pipelined=pipelined,
+        sonify=True, show_image=False, save_images=False,
+        synth_type=sound_drivers.NULL,
+        retriever_type=RetrieverTypes.Files if src else RetrieverTypes.Synthetic,
+        transformation=transformation,
+        log_level=logging.WARNING,
+        **kwargs
+    )
+    client = image_sonificator.rpi_cam_client
+
+    timer = StageTimer()
+    timer.wrap(client, 'get_frame', 'capture')
+    timer.wrap(image_sonificator, 'prepare_image', 'prepare')
+    timer.wrap(image_sonificator, 'process_full_size_image', 'transform')
+    timer.wrap(image_sonificator, 'downsample', 'downsample')
+    timer.wrap(image_sonificator.sonificator, 'sonify', 'sonify')
+    timer.wrap(image_sonificator, 'next', 'total')
+
+    capture = image_sonificator.capture
+
+    def capture_with_age():
+        frame = capture()
+        timer.record('frame_age', image_sonificator.frame_age)
+        return frame
+
+    image_sonificator.capture = capture_with_age
+
+    sonified = timer.durations['sonify']
+    if src:
+        # Recordings are replayed in a loop
+        get_frame = client.get_frame
+
+        def get_looped_frame():
+            if client.position >= len(client):
+                client.seek(0)
+            return get_frame()
+
+        client.get_frame = get_looped_frame
+
+    image_sonificator.start()
+    while len(sonified) < warmup_frames:
+        image_sonificator.next()
+
+    timer.reset()
+    started = time.perf_counter()
+    while len(sonified) < frames:
+        image_sonificator.next()
+    elapsed = time.perf_counter() - started
+
+    pipeline_stats = image_sonificator.get_pipeline_stats()
+    image_sonificator.stop()
+
+    sonificator = image_sonificator.sonificator
+    return {
+        'side_in': side_in,
+        'tones': len(sonificator.mapping),
+        'transformation': transformation,
+        'downsampling': image_sonificator.downsampler.method,
+        'pipelined': pipelined,
+        'image_size': list(client.image_size),
+        'frames': frames,
+        'fps': frames / elapsed,
+        'stages': timer.get_stats(),
+        'updated_tones': sonificator.total_updated_tones,
+        'skipped_tones': sonificator.total_skipped_tones,
+        'pipeline': pipeline_stats,
+    }
+
+
+def run_pipeline_benchmark(sides=SIDES, transformation_names=TRANSFORMATIONS, frames=120, warmup_frames=10,
+                           src=None, image_size='640x480', output=None, **kwargs):
+    """Sweeps grid sizes and transformations and writes results as JSON to `output` (if given)."""
+    results = []
+    for transformation in transformation_names:
+        for side_in in sides:
+            try:
+                result = measure_pipeline(side_in, transformation, frames=frames, warmup_frames=warmup_frames,
+                                          src=src, image_size=image_size, **kwargs)
+            except Exception as e:
+                logger.warning('Unable to measure {transformation} pipeline for side_in={side_in}: {error}'.format(
+                    transformation=transformation, side_in=side_in, error=e))
+                result = {'side_in': side_in, 'transformation': transformation, 'error': repr(e)}
+            else:
+                logger.info('{transformation}, side_in={side_in}: {fps:.1f} fps, {stages}'.format(
+                    transformation=transformation, side_in=side_in, fps=result['fps'],
+                    stages=', '.join('{stage} p95 {p95:.3f} ms'.format(stage=stage, p95=stats['p95'])
+                                     for stage, stats in result['stages'].items())))
+            results.append(result)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'source': src or image_size,
+        'frames': frames,
+        'warmup_frames': warmup_frames,
+        'results': results,
+    }
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info('Benchmark results are written to {}'.format(output))
+
+    return report
@@ -0,0 +1,90 @@
+import multiprocessing
+import wave
+
+import numpy as np
+
+from acoustic_sight import sound_drivers
+from acoustic_sight.sound_drivers import offline_tools
+from acoustic_sight.tools import get_logger
+from acoustic_sight_server.image_sonificator import ImageSonificator
+from acoustic_sight_server.rpi_cam_client.file_client import list_images
+from acoustic_sight_server.rpi_cam_client.image_retriever import RetrieverTypes
+
+
+logger = get_logger('recording_renderer')
+
+
+def render_chunk(src, start, stop, frame_samples, sample_rate, warmup_frames=None, **kwargs):
+    """
+    Renders frames `start` to `stop` of the recording into float32 samples.
+
+    Processing starts `warmup_frames` before the frame chunk crossfades from. By default it is derived from the
+    transformation (number of frames Canny trails take to decay below a single intensity step), or starts from the
+    first frame if its state never fades. Transformed images then match sequential rendering up to one intensity step.
+    Update thresholds and top-K fades of the sonificator are approximated, as they depend on all previous frames.
+    """
+    offline_tools.init_audio(sample_rate=sample_rate)
+    image_sonificator = ImageSonificator(
+        remote_host=src, remote_port=None,
+        sonify=True, show_image=False, save_images=False,
+        synth_type=sound_drivers.OFFLINE,
+        retriever_type=RetrieverTypes.Files,
+        **kwargs
+    )
+    synth = image_sonificator.sonificator.synth
+
+    if warmup_frames is None:
+        warmup_frames = image_sonificator.transforamtion.get_warmup_frames()
+    first = 0 if warmup_frames is None else max(0, start - 1 - warmup_frames)
+    image_sonificator.rpi_cam_client.seek(first)
+    image_sonificator.start()
+
+    output = np.zeros((stop - start) * frame_samples, dtype=np.float32)
+    for frame in range(first, stop):
+        image_sonificator.next()
+
+        # Previous frame is rendered only to crossfade from it
+        if frame >= start - 1:
+            synth.seek(frame * frame_samples)
+            samples = synth.render(frame_samples)
+            if frame >= start:
+                output[(frame - start) * frame_samples:(frame - start + 1) * frame_samples] = samples
+
+    image_sonificator.stop()
+
+    return output
+
+
+def _render_chunk(args):
+    args, kwargs = args
+    return render_chunk(*args, **kwargs)
+
+
+def render_recording(src, dst, frame_rate=6, sample_rate=44100, processes=None, chunk_frames=64, warmup_frames=None,
+                     **kwargs):
+    """
+    Sonifies recorded images from a directory or a tarball into 16 bit mono WAV file.
+
+    Recording is split into time slices of `chunk_frames` frames which are rendered in parallel by a process pool.
+    Each frame lasts `1 / frame_rate` seconds. Chunks are processed from `warmup_frames` earlier (see `render_chunk`).
+    """
+    n_frames = len(list_images(src))
+    frame_samples = int(round(sample_rate / frame_rate))
+    chunks = [
+        ((src, start, min(start + chunk_frames, n_frames), frame_samples, sample_rate),
+         dict(warmup_frames=warmup_frames, **kwargs))
+        for start in range(0, n_frames, chunk_frames)
+    ]
+    logger.info('Rendering {n_frames} frames from {src} in {n_chunks} chunks.'.format(
+        n_frames=n_frames, src=src, n_chunks=len(chunks)))
+
+    with multiprocessing.Pool(processes) as pool, wave.open(dst, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+
+        for i, samples in enumerate(pool.imap(_render_chunk, chunks)):
+            wav.writeframes((samples * (2 ** 15 - 1)).astype('<i2').tobytes())
+            logger.info('Rendered {done}/{total} chunks.'.format(done=i + 1, total=len(chunks)))
+
+    logger.info('Saved to: {dst}'.format(dst=dst))
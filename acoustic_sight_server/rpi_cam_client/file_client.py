@@ -0,0 +1,83 @@
+import io
+import os
+import tarfile
+
+from PIL import Image
+
+from acoustic_sight_server.rpi_cam_client.image_retriever import ImageRetriever
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def list_images(path):
+    """Returns sorted image names from directory or tarball saved by ImageSaver."""
+    if os.path.isdir(path):
+        names = [
+            os.path.relpath(os.path.join(root, name), path)
+            for root, _, files in os.walk(path)
+            for name in files
+            if is_image_name(name)
+        ]
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as tarball:
+            names = [member.name for member in tarball.getmembers() if member.isfile() and is_image_name(member.name)]
+    else:
+        raise ValueError('Recording should be a directory or a tarball: {path}.'.format(path=path))
+
+    # Image saver names files by capture time, so the order of base names is chronological
+    return sorted(names, key=os.path.basename)
+
+
+class FileImageClient(ImageRetriever):
+    """Replays recorded images from a directory or a tarball which path is passed as a host."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.path = self.host
+        self.names = list_images(self.path)
+        self.position = 0
+        self.tarball = None
+
+        if not self.names:
+            raise ValueError('No images found in {path}.'.format(path=self.path))
+
+        self.start()
+        self.image_size = self.read_image(self.names[0]).size
+
+    def start(self):
+        if self.tarball is None and not os.path.isdir(self.path):
+            self.tarball = tarfile.open(self.path)
+
+    def stop(self):
+        if self.tarball is not None:
+            self.tarball.close()
+            self.tarball = None
+
+    def seek(self, position):
+        self.position = position
+
+    def read_image(self, name):
+        if self.tarball is None:
+            image = Image.open(os.path.join(self.path, name))
+        else:
+            image = Image.open(io.BytesIO(self.tarball.extractfile(name).read()))
+        image.load()
+
+        return image
+
+    def get_image(self):
+        if self.position >= len(self.names):
+            raise EOFError('No more images in {path}.'.format(path=self.path))
+
+        image = self.read_image(self.names[self.position])
+        self.position += 1
+
+        return image
+
+    def __len__(self):
+        return len(self.names)
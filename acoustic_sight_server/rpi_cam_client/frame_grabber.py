@@ -0,0 +1,83 @@
+import threading
+import time
+
+from acoustic_sight.tools import get_logger
+
+
+logger = get_logger('FrameGrabber')
+
+
+# Delay before retrying failed device read (seconds)
+RETRY_INTERVAL = .05
+# Frames older than this are not returned while device reads keep failing (seconds)
+MAX_STALE_AGE = 1.
+
+
+class FrameGrabber:
+    """
+    Thread which continuously drains camera with `read_fn` and keeps only the latest frame.
+
+    Frames are tagged with `time.monotonic()` timestamps. `read_fn` should return a new object for every frame, since
+    the grabbed frame may still be used when the next one is read. If reads keep failing for longer than
+    `MAX_STALE_AGE` the last error is raised instead of returning the stale frame.
+    """
+    def __init__(self, read_fn, name='FrameGrabber'):
+        self.read_fn = read_fn
+        self.name = name
+
+        self._condition = threading.Condition()
+        self._frame = None
+        self._timestamp = None
+        self._running = False
+        self._thread = None
+
+        self.grabbed = 0
+        self.errors = 0
+        # Error of the last read, cleared when a frame is grabbed
+        self.error = None
+
+    def _run(self):
+        while self._running:
+            try:
+                frame = self.read_fn()
+            except Exception as e:
+                # Backends raise their own errors (like `cv2.error` or `pygame.error`)
+                self.errors += 1
+                self.error = e
+                logger.debug('{name} failed to read frame: {error}'.format(name=self.name, error=e))
+                time.sleep(RETRY_INTERVAL)
+                continue
+
+            timestamp = time.monotonic()
+            with self._condition:
+                self._frame = frame
+                self._timestamp = timestamp
+                self.grabbed += 1
+                self.error = None
+                self._condition.notify_all()
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self._thread.join()
+            self._frame = None
+            self._timestamp = None
+
+    def get(self, timeout=1.):
+        """Returns the latest frame and its timestamp, waits only for the very first frame."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frame is not None, timeout):
+                raise OSError('{name} has not grabbed any frame in {timeout} s: {error}'.format(
+                    name=self.name, timeout=timeout, error=self.error))
+
+            error = self.error
+            if error is not None and time.monotonic() - self._timestamp > MAX_STALE_AGE:
+                raise OSError('{name} fails to read frames: {error}'.format(name=self.name, error=error)) from error
+
+            return self._frame, self._timestamp
@@ -1,17 +1,49 @@
 import abc
 import os
 
+import numpy as np
+
 from acoustic_sight.tools import TimeMeasurer, get_logger
+from acoustic_sight_server.tools import get_crop_box
 
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 
 
+# Common camera modes (width, height) in ascending order of area
+CAMERA_MODES = (
+    (160, 120), (176, 144), (320, 240), (352, 288), (640, 480),
+    (800, 600), (1024, 768), (1280, 720), (1280, 960), (1920, 1080),
+)
+
+
+def covers(mode, min_size, aspect=None):
+    """Checks whether region of interest of the mode is not smaller than `min_size`."""
+    if aspect is not None:
+        _, _, width, height = get_crop_box(mode[0], mode[1], aspect)
+    else:
+        width, height = mode
+
+    return width >= min_size[0] and height >= min_size[1]
+
+
+def select_mode(modes, min_size, aspect=None):
+    """Returns the smallest mode which covers `min_size`, or the largest mode if none does."""
+    modes = sorted(set(modes), key=lambda mode: mode[0] * mode[1])
+    for mode in modes:
+        if covers(mode, min_size, aspect):
+            return mode
+
+    return modes[-1]
+
+
 class RetrieverTypes:
     SocketIO = 'SocketIO'
     Http = 'Http'
     PyGame = 'PyGame'
     OpenCV = 'OpenCV'
+    Files = 'Files'
+    Synthetic = 'Synthetic'
 
 
 def get_client(retriever_type):
@@ -27,14 +59,28 @@ def get_client(retriever_type):
     elif retriever_type == RetrieverTypes.OpenCV:
         from acoustic_sight_server.rpi_cam_client.opencv_client import OpenCVClient
         return OpenCVClient
+    elif retriever_type == RetrieverTypes.Files:
+        from acoustic_sight_server.rpi_cam_client.file_client import FileImageClient
+        return FileImageClient
+    elif retriever_type == RetrieverTypes.Synthetic:
+        from acoustic_sight_server.rpi_cam_client.synthetic_client import SyntheticImageClient
+        return SyntheticImageClient
     else:
         raise ValueError('Client is not supported: {client_type}.'.format(client_type=retriever_type))
 
 
 class ImageRetriever(object):
-    def __init__(self, host, port, logger=None, profile=False):
+    def __init__(self, host, port, logger=None, profile=False, min_size=None, aspect=None):
+        """
+        Camera clients choose capture mode covering `min_size` (width, height) after crop to `aspect` and crop images
+        to `aspect` at capture time. Other clients ignore these hints.
+        """
         self.host = host
         self.port = port
+        self.min_size = min_size
+        self.aspect = aspect
+        # Time passed since the last returned image was captured (seconds)
+        self.last_frame_age = 0.
 
         if logger is None:
             self.logger = get_logger('ImageRetriever')
@@ -44,6 +90,7 @@ class ImageRetriever(object):
         if profile:
             self.time_measurer = TimeMeasurer(logger=self.logger)
             self.time_measurer.decorate_method(self, self.get_image, 'Got image')
+            self.time_measurer.decorate_method(self, self.get_frame, 'Got frame')
 
     @abc.abstractmethod
     def start(self):
@@ -56,3 +103,11 @@ class ImageRetriever(object):
     @abc.abstractmethod
     def get_image(self):
         pass
+
+    def get_frame(self):
+        """
+        Returns the next image as uint8 grayscale array.
+
+        Array may be a view into a buffer reused by the following calls, copy it to keep it longer.
+        """
+        return np.asarray(self.get_image().convert('L'))
@@ -1,49 +1,184 @@
+import time
+
 import cv2
+import numpy as np
 from PIL import Image
 
-from acoustic_sight_server.rpi_cam_client.image_retriever import ImageRetriever
+from acoustic_sight_server.rpi_cam_client.frame_grabber import FrameGrabber
+from acoustic_sight_server.rpi_cam_client.image_retriever import CAMERA_MODES, ImageRetriever, covers, select_mode
+from acoustic_sight_server.tools import aspect_crop, get_crop_box
 
 
 class OpenCVClient(ImageRetriever):
-    def __init__(self, *args, **kwargs):
+    """
+    Captures images from the default OpenCV camera.
+
+    If `min_size` is given the smallest camera mode which covers it is negotiated on start. Camera is asked for raw
+    YUYV frames, so grayscale frames are views of their luma plane when the backend supports it. Frames are cropped to
+    `aspect` before conversion.
+
+    If `grab_frames` is set (default) a background thread drains the camera, so images are returned immediately and
+    are never older than a sensor period.
+    """
+    def __init__(self, *args, grab_frames=True, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.camera = None
-        self.image_size = (640, 480)
+        self.mode = (640, 480)
+        self.image_size = self.mode
+        self.raw_yuyv = False
 
         self.convert_to_PIL_Image = True
 
+        # Frames are captured and converted into reused buffers
+        self.frame = None
+        self.gray = None
+
+        self.grab_frames = grab_frames
+        self.grabber = None
+
     def start(self):
         if self.camera is not None:
             raise RuntimeError('Camera is already started: {}'.format(self.camera))
 
         self.camera = cv2.VideoCapture(0)
-        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.image_size[0])
-        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.image_size[1])
+
+        # Luma is read directly from raw frames if camera delivers YUYV, pixel format is set before probing modes
+        # since it affects the modes available
+        self.raw_yuyv = (self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV')) and
+                         self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+        if not self.raw_yuyv:
+            self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+
+        if self.min_size is None:
+            self.set_mode(self.mode)
+        else:
+            self.negotiate_mode()
         self.camera.set(cv2.CAP_PROP_FPS, 24)
+        # Driver may still switch mode when frame rate is set
+        self.mode = self.get_mode()
+
+        if self.aspect is None:
+            self.image_size = self.mode
+        else:
+            self.image_size = tuple(get_crop_box(self.mode[0], self.mode[1], self.aspect)[2:])
+        self.logger.info('Camera started in {mode} mode, frames are cropped to {size}.'.format(
+            mode=self.mode, size=self.image_size))
+
+        if self.grab_frames:
+            self.grabber = FrameGrabber(self.read_camera, name='OpenCVFrameGrabber')
+            self.grabber.start()
+
+    def set_mode(self, mode):
+        """Requests camera mode and returns the mode camera actually switched to."""
+        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, mode[0])
+        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, mode[1])
+
+        return self.get_mode()
+
+    def get_mode(self):
+        return int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def negotiate_mode(self):
+        """Switches camera to the smallest probed mode which covers the minimal size."""
+        probed = []
+        for mode in CAMERA_MODES:
+            if not covers(mode, self.min_size, self.aspect):
+                continue
+
+            # Camera may fall back to the closest mode it supports
+            actual = self.set_mode(mode)
+            if covers(actual, self.min_size, self.aspect):
+                return actual
+            probed.append(actual)
+
+        self.logger.warning('No camera mode covers {min_size}, the largest probed is used.'.format(
+            min_size=self.min_size))
+        return self.set_mode(select_mode(probed or CAMERA_MODES, self.min_size, self.aspect))
 
     def stop(self):
         if self.camera is None:
             raise RuntimeError('Camera is already stopped')
 
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
+
         self.camera.release()
         cv2.destroyAllWindows()
         self.camera = None
 
-    def get_image(self):
+    def read_camera(self, frame=None):
+        ok, frame = self.camera.read(frame)
+        if not ok:
+            raise OSError('Unable to read frame from camera.')
+
+        return frame
+
+    def read(self):
         if self.camera is None:
             raise RuntimeError('Trying to capture image for stopped camera.')
 
-        _, frame = self.camera.read()
+        if self.grabber is not None:
+            frame, timestamp = self.grabber.get()
+            self.last_frame_age = time.monotonic() - timestamp
+            return frame
 
-        if self.convert_to_PIL_Image:
-            cv2_image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            image = Image.fromarray(cv2_image)
+        self.frame = self.read_camera(self.frame)
 
-            return image
-        else:
+        return self.frame
+
+    def crop(self, frame):
+        if self.aspect is None:
             return frame
+        return aspect_crop(frame, self.aspect)
+
+    def get_yuyv(self, frame):
+        """Returns raw frame as (height, width, 2) YUYV array, or None if backend has converted it to BGR anyway."""
+        if frame.ndim == 3 and frame.shape[2] == 3:
+            return None
+
+        width, height = self.mode
+        if frame.size != width * height * 2:
+            raise RuntimeError('Unexpected raw frame of {shape} shape for {mode} YUYV mode.'.format(
+                shape=frame.shape, mode=self.mode))
+
+        # Some backends return raw buffer as a single row
+        return frame.reshape((height, width, 2))
+
+    def get_frame(self):
+        frame = self.read()
 
+        if self.raw_yuyv:
+            yuyv = self.get_yuyv(frame)
+            if yuyv is not None:
+                # Luma is the first byte of each pixel
+                return self.crop(yuyv[:, :, 0])
+        elif frame.ndim == 2:
+            return self.crop(frame)
+
+        roi = self.crop(frame)
+        if self.gray is None or self.gray.shape != roi.shape[:2]:
+            self.gray = np.empty(roi.shape[:2], dtype=np.uint8)
+
+        return cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+    def get_color_frame(self):
+        """Returns BGR frame cropped to the region of interest."""
+        frame = self.read()
+
+        if self.raw_yuyv:
+            yuyv = self.get_yuyv(frame)
+            if yuyv is not None:
+                return self.crop(cv2.cvtColor(yuyv, cv2.COLOR_YUV2BGR_YUYV))
+
+        return self.crop(frame).copy()
+
+    def get_image(self):
+        if self.convert_to_PIL_Image:
+            return Image.fromarray(self.get_frame())
+        else:
+            return self.get_color_frame()
 
 def capture(filename):
     client = OpenCVClient()
@@ -1,38 +1,133 @@
-import pygame.image
+import time
+
+import numpy as np
 import pygame.camera
+import pygame.image
+import pygame.surfarray
 from PIL import Image
 
-from acoustic_sight_server.rpi_cam_client.image_retriever import ImageRetriever
+from acoustic_sight_server.rpi_cam_client.frame_grabber import FrameGrabber
+from acoustic_sight_server.rpi_cam_client.image_retriever import CAMERA_MODES, ImageRetriever, covers, select_mode
+from acoustic_sight_server.tools import get_crop_box
+
+
+# Integer RGB to luma weights which sum up to 256
+LUMA_WEIGHTS = np.array([77, 150, 29], dtype=np.uint16)
 
 
 class PyGameClient(ImageRetriever):
-    def __init__(self, *args, **kwargs):
+    """
+    Captures images from the first camera found by PyGame.
+
+    In `'YUV'` colorspace (default) grayscale frames are views of the luma plane of captured surfaces, which PyGame
+    stores in the first channel.
+
+    If `min_size` is given the smallest camera mode which covers it is negotiated on start, and frames are cropped to
+    `aspect` at capture.
+
+    If `grab_frames` is set (default) a background thread drains the camera, so images are returned immediately and
+    are never older than a sensor period.
+    """
+    def __init__(self, *args, colorspace='YUV', grab_frames=True, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.camera = None
-        self.image_size = (160, 120)
+        self.mode = (160, 120)
+        self.crop_box = (0, 0) + self.mode
+        self.image_size = self.mode
+        self.colorspace = colorspace
+
+        self.grab_frames = grab_frames
+        self.grabber = None
 
         pygame.camera.init()
 
+    def open_camera(self, device, mode):
+        camera = pygame.camera.Camera(device, mode, self.colorspace)
+        camera.start()
+        return camera
+
+    def negotiate_mode(self, device):
+        """Starts camera in the smallest probed mode which covers the minimal size."""
+        probed = []
+        for mode in CAMERA_MODES:
+            if not covers(mode, self.min_size, self.aspect):
+                continue
+
+            camera = self.open_camera(device, mode)
+            # Camera may fall back to the closest mode it supports
+            if covers(camera.get_size(), self.min_size, self.aspect):
+                return camera
+            probed.append(camera.get_size())
+            camera.stop()
+
+        self.logger.warning('No camera mode covers {min_size}, the largest probed is used.'.format(
+            min_size=self.min_size))
+        return self.open_camera(device, select_mode(probed or CAMERA_MODES, self.min_size, self.aspect))
+
     def start(self):
         if self.camera is not None:
             raise RuntimeError('Camera is already started: {}'.format(self.camera))
 
-        self.camera = pygame.camera.Camera(pygame.camera.list_cameras()[0], self.image_size)
-        self.camera.start()
+        device = pygame.camera.list_cameras()[0]
+        if self.min_size is None:
+            self.camera = self.open_camera(device, self.mode)
+        else:
+            self.camera = self.negotiate_mode(device)
+
+        self.mode = tuple(self.camera.get_size())
+        if self.aspect is None:
+            self.crop_box = (0, 0) + self.mode
+        else:
+            self.crop_box = get_crop_box(self.mode[0], self.mode[1], self.aspect)
+        self.image_size = tuple(self.crop_box[2:])
+        self.logger.info('Camera started in {mode} mode, frames are cropped to {size}.'.format(
+            mode=self.mode, size=self.image_size))
+
+        if self.grab_frames:
+            # Camera returns a new surface for every image
+            self.grabber = FrameGrabber(self.camera.get_image, name='PyGameFrameGrabber')
+            self.grabber.start()
 
     def stop(self):
         if self.camera is None:
             raise RuntimeError('Camera is already stopped')
 
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
+
         self.camera.stop()
         self.camera = None
 
-    def get_image(self):
+    def get_surface(self):
         if self.camera is None:
             raise RuntimeError('Trying to capture image for stopped camera.')
 
-        surface = self.camera.get_image()
+        if self.grabber is not None:
+            surface, timestamp = self.grabber.get()
+            self.last_frame_age = time.monotonic() - timestamp
+            return surface
+
+        return self.camera.get_image()
+
+    def get_frame(self):
+        # Surface arrays are indexed by (x, y), slices and transposition are views as well
+        left, top, width, height = self.crop_box
+        pixels = pygame.surfarray.pixels3d(self.get_surface())[left:left + width, top:top + height]
+
+        if self.colorspace == 'YUV':
+            return pixels[:, :, 0].T
+
+        gray = np.dot(pixels, LUMA_WEIGHTS)
+        gray >>= 8
+        return gray.astype(np.uint8).T
+
+    def get_image(self):
+        if self.colorspace == 'YUV':
+            return Image.fromarray(np.ascontiguousarray(self.get_frame()))
+
+        surface = self.get_surface().subsurface(pygame.Rect(self.crop_box))
         imgstr = pygame.image.tostring(surface, 'RGB')
         return Image.frombytes('RGB', surface.get_size(), imgstr)
 
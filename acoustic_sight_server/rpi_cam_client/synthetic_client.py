@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+from PIL import Image
+
+from acoustic_sight_server.rpi_cam_client.image_retriever import ImageRetriever
+
+
+DEFAULT_SIZE = (640, 480)
+
+
+def parse_size(size):
+    """
+    Parses image size and frame rate from `'WIDTHxHEIGHT[@FPS]'` string.
+
+    Default size is used for anything else, frame rate is None if not specified.
+    """
+    size, _, frame_rate = str(size).partition('@')
+    try:
+        width, height = (int(x) for x in size.lower().split('x'))
+        frame_rate = float(frame_rate) if frame_rate else None
+    except ValueError:
+        return DEFAULT_SIZE, None
+    return (width, height), frame_rate
+
+
+def get_synthetic_frames(image_size, n_frames=32, seed=0):
+    """Returns RGB frames of a bright square moving over a gradient with sensor noise."""
+    width, height = image_size
+    rng = np.random.RandomState(seed)
+
+    ys, xs = np.indices((height, width))
+    background = (xs * 128 // max(width, 1) + ys * 64 // max(height, 1)).astype(np.int16)
+    side = max(1, min(width, height) // 4)
+
+    frames = np.empty((n_frames, height, width, 3), dtype=np.uint8)
+    for i in range(n_frames):
+        frame = background + rng.randint(-8, 9, size=background.shape)
+        left = (width - side) * i // max(n_frames - 1, 1)
+        top = (height - side) // 2
+        frame[top:top + side, left:left + side] = 230
+        frames[i] = np.clip(frame, 0, 255).astype(np.uint8)[..., None]
+
+    return frames
+
+
+class SyntheticImageClient(ImageRetriever):
+    """
+    Generates frames, so the pipeline may run without a camera.
+
+    Host is parsed as `'WIDTHxHEIGHT[@FPS]'`. If frame rate is given `get_image` waits for the next frame like a camera.
+    """
+    def __init__(self, *args, n_frames=32, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.image_size, self.frame_rate = parse_size(self.host)
+        self.frames = get_synthetic_frames(self.image_size, n_frames=n_frames)
+        # Frames are gray, so luma is any of channels
+        self.gray_frames = self.frames[..., 0]
+        self.position = 0
+        self.next_frame_time = time.time()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def wait_frame(self):
+        if self.frame_rate:
+            now = time.time()
+            self.next_frame_time = max(self.next_frame_time + 1 / self.frame_rate, now)
+            time.sleep(self.next_frame_time - now)
+
+        index = self.position % len(self.frames)
+        self.position += 1
+
+        return index
+
+    def get_frame(self):
+        return self.gray_frames[self.wait_frame()]
+
+    def get_image(self):
+        return Image.fromarray(self.frames[self.wait_frame()], 'RGB')
@@ -5,7 +5,7 @@ from aiohttp_index import IndexMiddleware
 import socketio
 
 from acoustic_sight.tools import get_logger
-from acoustic_sight import sound_drivers
+from acoustic_sight import mappings, sound_drivers
 from acoustic_sight_server.image_sonificator import ImageSonificator
 from acoustic_sight_server.rpi_cam_client.image_retriever import RetrieverTypes
 
@@ -18,13 +18,17 @@ async def close_all_connections(sio):
 class AcousticSightServer(object):
     def __init__(self, host=None, port=8090, remote_host='localhost',
                  remote_port=8000, frame_rate=24, side_in=2**3,
+                 width_in=None, height_in=None, mapping=mappings.HILBERT,
+                 fovea_scale=None, fovea_fraction=.5,
                  octaves=6, tone_shift=-18,
                  synth_type=sound_drivers.PY_GAME,
                  retriever_type=RetrieverTypes.PyGame,
                  log_level=logging.INFO,
                  profile=False,
                  save_images=False,
-                 sigma=2, initial_mul=32, decrease=1.2,
+                 sigma=2, initial_mul=32, decrease=1.2, canny_backend=None,
+                 downsampling=None, percentile=90,
+                 top_k=None, latency=None,
                  **server_args):
         self.logger = get_logger('acoustic_sight_server.server', level=log_level)
 
@@ -40,13 +44,17 @@ class AcousticSightServer(object):
         self.remote_image_sonification = ImageSonificator(
             frame_rate=frame_rate, remote_host=remote_host,
             remote_port=remote_port, side_in=side_in,
+            width_in=width_in, height_in=height_in, mapping=mapping,
+            fovea_scale=fovea_scale, fovea_fraction=fovea_fraction,
             octaves=octaves, tone_shift=tone_shift,
             synth_type=synth_type,
             retriever_type=retriever_type,
             logger=self.logger,
             profile=profile,
             save_images=save_images,
-            sigma=sigma, initial_mul=initial_mul, decrease=decrease,
+            sigma=sigma, initial_mul=initial_mul, decrease=decrease, canny_backend=canny_backend,
+            downsampling=downsampling, percentile=percentile,
+            top_k=top_k, latency=latency,
         )
 
         self.setup_events()
@@ -1,13 +1,23 @@
-def square_crop(img):
+def get_crop_box(width, height, aspect=1.):
+    """Returns (left, top, width, height) of the central region with the given width to height ratio."""
+    crop_width = min(width, int(round(height * aspect)))
+    crop_height = min(height, int(round(width / aspect)))
+    left = (width - crop_width) // 2
+    top = (height - crop_height) // 2
+
+    return left, top, crop_width, crop_height
+
+
+def aspect_crop(img, aspect=1.):
+    """Crops central region of the image with the given width to height ratio."""
     (height, width, *_) = img.shape
+    left, top, crop_width, crop_height = get_crop_box(width, height, aspect)
+
+    return img[top:top + crop_height, left:left + crop_width]
 
-    side = min((width, height))
-    left = (width - side) // 2
-    right = left + side
-    top = (height - side) // 2
-    bottom = top + side
 
-    return img[top:bottom, left:right]
+def square_crop(img):
+    return aspect_crop(img, aspect=1.)
 
 
 def get_free_port():
@@ -0,0 +1,21 @@
+NONE = 'none'
+CANNY = 'canny'
+HOG = 'hog'
+OPTICAL_FLOW = 'optical_flow'
+
+
+def get_transformation(name):
+    if name == NONE:
+        from acoustic_sight_server.transformations.basic import IdentityTransformation
+        return IdentityTransformation
+    elif name == CANNY:
+        from acoustic_sight_server.transformations.basic import CannyTransformation
+        return CannyTransformation
+    elif name == HOG:
+        from acoustic_sight_server.transformations.basic import HogTransformation
+        return HogTransformation
+    elif name == OPTICAL_FLOW:
+        from acoustic_sight_server.transformations.open_cv import OpenCVOpticalFlowTransformation
+        return OpenCVOpticalFlowTransformation
+    else:
+        raise ValueError('Transformation is not supported: {name}.'.format(name=name))
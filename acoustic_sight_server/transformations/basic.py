@@ -1,10 +1,31 @@
 import abc
+import math
 
 import numpy as np
 import skimage.feature
 
+from acoustic_sight_server import downsampling
+
+
+CANNY_CV2 = 'cv2'
+CANNY_SKIMAGE = 'skimage'
+
+CANNY_BACKENDS = (CANNY_CV2, CANNY_SKIMAGE)
+
+
+def has_cv2():
+    try:
+        import cv2
+    except ImportError:
+        return False
+
+    return True
+
 
 class ImageTransformation(object):
+    # Default method used to downsample transformed images to the tone grid
+    downsampling = downsampling.MEAN
+
     def __init__(self, sonificator):
         self.sonificator = sonificator
 
@@ -13,15 +34,24 @@ class ImageTransformation(object):
         self.show_image(result)
         return result
 
+    def get_warmup_frames(self):
+        """Returns number of frames after which earlier frames no longer affect the result (None if they always do)."""
+        return 0
+
     def show_image(self, image, name=''):
         if self.sonificator.show_image:
-            self.sonificator.cv2.imshow(self.__class__.__name__ + ' - %s' % name, image)
+            self.sonificator.display(self.__class__.__name__ + ' - %s' % name, image)
 
     @abc.abstractmethod
     def _process(self, image):
         return image
 
 
+class IdentityTransformation(ImageTransformation):
+    def _process(self, image):
+        return image
+
+
 class HogTransformation(ImageTransformation):
     def _process(self, image):
         fd, hog_image = skimage.feature.hog(
@@ -37,23 +67,87 @@ class HogTransformation(ImageTransformation):
 
 
 class CannyTransformation(ImageTransformation):
-    def __init__(self, *args, sigma=1, initial_mul=32, decrease=1.2, **kwargs):
+    """
+    Detects edges and accumulates them into decaying trails.
+
+    Edges add `initial_mul` to a float32 persistence buffer which is divided by `decrease` every frame, and the result
+    is saturated to uint8. With `cv2` backend (default if OpenCV is available) the image is blurred by
+    `cv2.GaussianBlur` and passed to `cv2.Canny`, all into preallocated buffers, so no memory is allocated per frame.
+    Thresholds are relative to the full intensity range in both backends.
+    """
+    # Averaging would erase one pixel edges
+    downsampling = downsampling.MAX
+
+    def __init__(self, *args, sigma=1, initial_mul=32, decrease=1.2, backend=None,
+                 low_threshold=.1, high_threshold=.2, **kwargs):
         super().__init__(*args, **kwargs)
 
+        if backend is None:
+            backend = CANNY_CV2 if has_cv2() else CANNY_SKIMAGE
+        if backend not in CANNY_BACKENDS:
+            raise ValueError('Canny backend is not supported: {backend}.'.format(backend=backend))
+
         self.sigma = sigma
         self.initial_mul = initial_mul
         self.decrease = decrease
-
-        self.previous = None
+        self.backend = backend
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+
+        self.cv2 = None
+        if backend == CANNY_CV2:
+            import cv2
+            self.cv2 = cv2
+
+        self.shape = None
+        self.blurred = None
+        self.edges = None
+        self.mask = None
+        self.persistence = None
+        self.result = None
+
+    def prepare(self, shape):
+        """Allocates buffers for images of the given shape, edge trails start over."""
+        self.blurred = np.empty(shape, dtype=np.uint8)
+        self.edges = np.empty(shape, dtype=np.uint8)
+        self.mask = np.empty(shape, dtype=bool)
+        self.persistence = np.zeros(shape, dtype=np.float32)
+        self.result = np.empty(shape, dtype=np.uint8)
+        self.shape = shape
+
+    def get_warmup_frames(self):
+        """
+        Returns number of frames it takes to decay saturated trail below a single intensity step.
+
+        Fractions of a step may still carry over into trails of later edges, so results differ by at most one step.
+        """
+        if self.decrease <= 1:
+            return None
+        return int(math.log(255) / math.log(self.decrease)) + 1
+
+    def detect_edges(self, image):
+        """Returns boolean mask of edges."""
+        if self.backend == CANNY_CV2:
+            self.cv2.GaussianBlur(image, (0, 0), self.sigma, dst=self.blurred)
+            self.cv2.Canny(self.blurred, self.low_threshold * 255, self.high_threshold * 255,
+                           edges=self.edges, L2gradient=True)
+            return np.greater(self.edges, 0, out=self.mask)
+        else:
+            # Thresholds of integer images are given in their own range
+            scale = np.iinfo(image.dtype).max if image.dtype.kind in 'ui' else 1
+            return skimage.feature.canny(image, sigma=self.sigma,
+                                         low_threshold=self.low_threshold * scale,
+                                         high_threshold=self.high_threshold * scale)
 
     def _process(self, image):
-        canny_bools = skimage.feature.canny(image, sigma=self.sigma)
-        canny_image = canny_bools.astype(np.uint8) * self.initial_mul
+        if image.shape != self.shape:
+            self.prepare(image.shape)
 
-        if image.shape[0] == self.sonificator.rpi_cam_client.image_size[1]:
-            if self.previous is not None:
-                canny_image += self.previous
+        edges = self.detect_edges(image)
 
-            self.previous = (canny_image / 1.2).astype(np.uint8)
+        self.persistence *= 1. / self.decrease
+        np.add(self.persistence, self.initial_mul, out=self.persistence, where=edges)
+        np.minimum(self.persistence, 255, out=self.persistence)
+        np.copyto(self.result, self.persistence, casting='unsafe')
 
-        return canny_image
+        return self.result
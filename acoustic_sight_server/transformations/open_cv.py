@@ -11,6 +11,9 @@ class OpenCVOpticalFlowTransformation(ImageTransformation):
         self.previous = None
         self.hsv = None
 
+    def get_warmup_frames(self):
+        return 1
+
     def _process(self, image):
         if image.shape[0] != self.sonificator.rpi_cam_client.image_size[1] or image.shape[0] != image.shape[1]:
             return np.zeros_like(image)
@@ -10,7 +10,7 @@ from manager import Manager
 import yaml
 
 from acoustic_sight.tools import PROJECT_DIR, SERVICES_DIR
-from acoustic_sight import sound_drivers
+from acoustic_sight import mappings, sound_drivers
 from acoustic_sight_server.image_sonificator import ImageSonificator
 from acoustic_sight_server.rpi_cam_client.image_retriever import RetrieverTypes
 import acoustic_sight_server.server
@@ -86,19 +86,25 @@ def get_remote_config(url=REMOTE_CONFIG_URL, filename=REMOTE_CONFIG_PATH, timeou
 
 @manager.command
 def remote_image_sonificator(remote_host='localhost', remote_port=80, frame_rate=6,
-                             side_in=2**3, sonify=True, show_image=False,
+                             side_in=2**3, width_in=None, height_in=None,
+                             mapping=mappings.HILBERT, fovea_scale=None, fovea_fraction=.5,
+                             sonify=True, show_image=False,
                              octaves=6, tone_shift=-18,
                              synth_type=sound_drivers.PY_GAME,
                              retriever_type=RetrieverTypes.PyGame,
                              log_level='INFO',
                              profile=False,
                              save_images=False,
-                             sigma=2, initial_mul=32, decrease=1.2,
+                             sigma=2, initial_mul=32, decrease=1.2, canny_backend=None,
+                             downsampling=None, percentile=90,
+                             top_k=None, latency=None, pipelined=False,
                              ):
     """Runs image sonificator"""
     sonificator = ImageSonificator(
         remote_host=remote_host, remote_port=remote_port,
         frame_rate=frame_rate, side_in=side_in,
+        width_in=width_in, height_in=height_in, mapping=mapping,
+        fovea_scale=fovea_scale, fovea_fraction=fovea_fraction,
         octaves=octaves, tone_shift=tone_shift,
         sonify=sonify, show_image=show_image,
         synth_type=synth_type,
@@ -106,7 +112,9 @@ def remote_image_sonificator(remote_host='localhost', remote_port=80, frame_rate
         log_level=log_level,
         profile=profile,
         save_images=save_images,
-        sigma=sigma, initial_mul=initial_mul, decrease=decrease,
+        sigma=sigma, initial_mul=initial_mul, decrease=decrease, canny_backend=canny_backend,
+        downsampling=downsampling, percentile=float(percentile),
+        top_k=top_k, latency=latency, pipelined=pipelined,
     )
     sonificator.run()
 
@@ -114,25 +122,89 @@ def remote_image_sonificator(remote_host='localhost', remote_port=80, frame_rate
 @manager.command
 def runserver(host=None, port=8090, remote_host='localhost',
               remote_port=80, frame_rate=6, side_in=2**3,
+              width_in=None, height_in=None, mapping=mappings.HILBERT,
+              fovea_scale=None, fovea_fraction=.5,
               octaves=6, tone_shift=-18,
               synth_type=sound_drivers.PY_GAME,
               retriever_type=RetrieverTypes.PyGame,
               log_level='INFO',
               profile=False,
               save_images=False,
-              sigma=2, initial_mul=32, decrease=1.2,
+              sigma=2, initial_mul=32, decrease=1.2, canny_backend=None,
+              downsampling=None, percentile=90,
+              top_k=None, latency=None,
               ):
     acoustic_sight_server.server.run(
         host=host, port=port,
         remote_host=remote_host, remote_port=remote_port,
         frame_rate=frame_rate, side_in=side_in,
+        width_in=width_in, height_in=height_in, mapping=mapping,
+        fovea_scale=fovea_scale, fovea_fraction=fovea_fraction,
         octaves=octaves, tone_shift=tone_shift,
         synth_type=synth_type,
         retriever_type=retriever_type,
         log_level=log_level,
         profile=profile,
         save_images=save_images,
-        sigma=sigma, initial_mul=initial_mul, decrease=decrease,
+        sigma=sigma, initial_mul=initial_mul, decrease=decrease, canny_backend=canny_backend,
+        downsampling=downsampling, percentile=float(percentile),
+        top_k=top_k, latency=latency,
+    )
+
+
+@manager.command
+def bench_drivers(output='bench-drivers.json', drivers=None, tones='64,256,1024', frames=48, frame_rate=24):
+    """Measures sound drivers headless and writes results as JSON"""
+    from acoustic_sight.sound_drivers.benchmark import DRIVERS, run_benchmark
+    run_benchmark(
+        drivers=drivers.split(',') if drivers else DRIVERS,
+        tone_counts=[int(n) for n in str(tones).split(',')],
+        frames=int(frames), frame_rate=float(frame_rate),
+        output=output,
+    )
+
+
+@manager.command
+def bench_pipeline(output='bench-pipeline.json', src=None, image_size='640x480',
+                   side_in='8,16,32,64', transformations='none,canny', frames=120, warmup_frames=10,
+                   mapping=mappings.HILBERT, pipelined=False, downsampling=None):
+    """Measures image sonification pipeline with the null sound driver and writes results as JSON"""
+    from acoustic_sight_server.pipeline_benchmark import run_pipeline_benchmark
+    run_pipeline_benchmark(
+        sides=[int(n) for n in str(side_in).split(',')],
+        transformation_names=transformations.split(','),
+        frames=int(frames), warmup_frames=int(warmup_frames),
+        src=src, image_size=image_size,
+        output=output,
+        mapping=mapping, pipelined=pipelined, downsampling=downsampling,
+    )
+
+
+@manager.command
+def sonify_recording(src, dst, frame_rate=6, sample_rate=44100, processes=None,
+                     chunk_frames=64, warmup_frames=None,
+                     side_in=2**3, width_in=None, height_in=None,
+                     mapping=mappings.HILBERT, fovea_scale=None, fovea_fraction=.5,
+                     octaves=6, tone_shift=-18,
+                     log_level='INFO',
+                     sigma=2, initial_mul=32, decrease=1.2, canny_backend=None,
+                     downsampling=None, percentile=90,
+                     top_k=None,
+                     ):
+    """Renders recorded images (tarball or directory) into WAV file"""
+    from acoustic_sight_server.recording_renderer import render_recording
+    render_recording(
+        src, dst,
+        frame_rate=frame_rate, sample_rate=sample_rate,
+        processes=int(processes) if processes else None,
+        chunk_frames=chunk_frames, warmup_frames=int(warmup_frames) if warmup_frames is not None else None,
+        side_in=side_in, width_in=width_in, height_in=height_in, mapping=mapping,
+        fovea_scale=fovea_scale, fovea_fraction=fovea_fraction,
+        octaves=octaves, tone_shift=tone_shift,
+        log_level=log_level,
+        sigma=sigma, initial_mul=initial_mul, decrease=decrease, canny_backend=canny_backend,
+        downsampling=downsampling, percentile=float(percentile),
+        top_k=top_k,
     )
 
 
@@ -217,17 +289,41 @@ def pg_tools_test():
     test()
 
 
+@manager.command
+def pg_mix_tools_test():
+    from acoustic_sight.sound_drivers.pg_tools import mix_test
+    mix_test()
+
+
 @manager.command
 def sc_tools_test():
     from acoustic_sight.sound_drivers.sc_tools import test
     test()
 
 
+@manager.command
+def sc_bank_tools_test():
+    from acoustic_sight.sound_drivers.sc_tools import bank_test
+    bank_test()
+
+
 @manager.command
 def pa_tools_test():
     from acoustic_sight.sound_drivers.pa_tools import test
     test()
 
 
+@manager.command
+def pa_block_tools_test():
+    from acoustic_sight.sound_drivers.pa_tools import block_test
+    block_test()
+
+
+@manager.command
+def pa_sharded_tools_test():
+    from acoustic_sight.sound_drivers.sharded_tools import test
+    test()
+
+
 if __name__ == '__main__':
     manager.main()